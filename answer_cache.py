@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                                 Answer Cache
+  A local cache that replays the answers of repeated questions.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import unicodedata
+
+# remove whitespace and punctuation of both ASCII and CJK.
+NORMALIZE_PATTERN = re.compile(r'[\s　-〿＀-／：-＠!-/:-@\[-`{-~]+')
+
+# the ASCII words, including the dotted or colon separated names such as "EPSG:4326" and "roads.shp".
+WORD_PATTERN = re.compile(r'[0-9A-Za-z_]+(?:[.:][0-9A-Za-z_]+)*')
+CJK_RUN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+CJK_NUMERAL_PATTERN = re.compile(r'[〇一二三四五六七八九十百千万亿两]+')
+# the quoted layer and field names.
+QUOTED_PATTERN = re.compile(r'"([^"\n]+)"|`([^`\n]+)`|“([^”\n]+)”|「([^」\n]+)」|《([^》\n]+)》')
+
+
+class AnswerCache:
+    """
+    Map normalized questions to the history records which answered them.
+
+    Entries are stored in the answer_cache table of the history database, so
+    they last as long as their TTL across sessions. The answer itself is always
+    read from the history manager, so removed histories are never replayed.
+    """
+
+    def __init__(self, history_manager, max_size=200, ttl=7 * 24 * 3600, similarity_threshold=0.8):
+        self.manager = history_manager
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+    @staticmethod
+    def create_table(connection):
+        """create the table of entries in the history database, the caller commits."""
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS answer_cache ("
+            "normalized_prompt TEXT NOT NULL, "
+            "fingerprint TEXT NOT NULL, "
+            "prompt TEXT NOT NULL DEFAULT '', "
+            "timestamp INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL, "
+            "PRIMARY KEY (normalized_prompt, fingerprint))")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_fingerprint ON answer_cache (fingerprint)")
+
+        # the table of earlier versions has no prompt, whose entries match exactly only.
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(answer_cache)")]
+        if "prompt" not in columns:
+            connection.execute("ALTER TABLE answer_cache ADD COLUMN prompt TEXT NOT NULL DEFAULT ''")
+
+    @staticmethod
+    def normalize_prompt(prompt: str):
+        # the full width letters and digits become ASCII.
+        return NORMALIZE_PATTERN.sub('', unicodedata.normalize('NFKC', prompt)).lower()
+
+    @staticmethod
+    def prompt_identifiers(prompt: str):
+        """
+        The numbers, codes and names in prompt, which must be the same in nearly same questions:
+        words with digits, "_", "." or ":", acronyms and camel case words, CJK numerals and quoted text.
+        """
+        prompt = unicodedata.normalize('NFKC', prompt)
+        identifiers = [word.lower() for word in WORD_PATTERN.findall(prompt)
+                       if any(char.isdigit() or char in '_.:' for char in word) or
+                       any(char.isupper() for char in word[1:])]
+        identifiers.extend(CJK_NUMERAL_PATTERN.findall(prompt))
+        identifiers.extend(next(group for group in match.groups() if group).strip().lower()
+                           for match in QUOTED_PATTERN.finditer(prompt))
+        return identifiers
+
+    @staticmethod
+    def prompt_features(prompt: str):
+        """the ASCII words and the CJK character bigrams of prompt, compared by jaccard similarity."""
+        prompt = unicodedata.normalize('NFKC', prompt)
+        features = {word.lower() for word in WORD_PATTERN.findall(prompt)}
+        for run in CJK_RUN_PATTERN.findall(prompt):
+            if len(run) == 1:
+                features.add(run)
+            features.update(run[index:index + 2] for index in range(len(run) - 1))
+        return features
+
+    @staticmethod
+    def workspace_fingerprint(workspace_info: dict):
+        """hash the parts of workspace which may change the answer, ignoring extent and statistics."""
+        layers = []
+        for layer_info in workspace_info.get("Layers", []):
+            layers.append([
+                layer_info.get("name"),
+                layer_info.get("type"),
+                layer_info.get("CRSAuthId"),
+                [field.get("name") for field in layer_info.get("fields", [])]
+            ])
+        relevant_info = {
+            "version": workspace_info.get("version"),
+            "CRSAuthId": workspace_info.get("CRSAuthId"),
+            "Layers": sorted(layers, key=lambda layer: json.dumps(layer))
+        }
+        return hashlib.sha1(json.dumps(relevant_info, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def lookup(self, prompt: str, fingerprint: str):
+        """return the history record answering the same or a nearly same question."""
+        if self.manager.connection is None:
+            return None
+
+        normalized_prompt = self.normalize_prompt(prompt)
+        if not normalized_prompt:
+            return None
+
+        # the entries queued by put() may not be written yet, which only misses the cache.
+        expire_time = time.time() - self.ttl
+        try:
+            with self.manager.connection_lock:
+                row = self.manager.connection.execute(
+                    "SELECT normalized_prompt, timestamp FROM answer_cache "
+                    "WHERE normalized_prompt = ? AND fingerprint = ? AND created_at >= ?",
+                    (normalized_prompt, fingerprint, expire_time)).fetchone()
+                if row is None:
+                    row = self._find_near_duplicate(prompt, fingerprint, expire_time)
+        except sqlite3.Error:
+            return None
+
+        if row is None:
+            return None
+
+        history_item = self.manager.retrieve_history(row["timestamp"])
+        if history_item is None:
+            # the history has been removed.
+            self.manager.writer.enqueue(
+                "DELETE FROM answer_cache WHERE normalized_prompt = ? AND fingerprint = ?",
+                (row["normalized_prompt"], fingerprint))
+            return None
+
+        self.manager.writer.enqueue(
+            "UPDATE answer_cache SET accessed_at = ? WHERE normalized_prompt = ? AND fingerprint = ?",
+            (time.time(), row["normalized_prompt"], fingerprint))
+        return history_item
+
+    def put(self, prompt: str, fingerprint: str, timestamp: int):
+        if self.manager.connection is None:
+            return
+
+        normalized_prompt = self.normalize_prompt(prompt)
+        if not normalized_prompt:
+            return
+
+        now = time.time()
+        self.manager.writer.enqueue(
+            "INSERT OR REPLACE INTO answer_cache "
+            "(normalized_prompt, fingerprint, prompt, timestamp, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (normalized_prompt, fingerprint, prompt, timestamp, now, now))
+
+        # remove the expired entries, and evict the least recently used ones.
+        self.manager.writer.enqueue("DELETE FROM answer_cache WHERE created_at < ?", (now - self.ttl,))
+        self.manager.writer.enqueue(
+            "DELETE FROM answer_cache WHERE rowid NOT IN "
+            "(SELECT rowid FROM answer_cache ORDER BY accessed_at DESC LIMIT ?)",
+            (self.max_size,))
+
+    def clear(self):
+        if self.manager.connection is not None:
+            self.manager.writer.enqueue("DELETE FROM answer_cache")
+
+    def _find_near_duplicate(self, prompt, fingerprint, expire_time):
+        """the most similar entry of the same identifiers, the caller holds the connection lock."""
+        identifiers = self.prompt_identifiers(prompt)
+        features = self.prompt_features(prompt)
+
+        best_row = None
+        best_similarity = self.similarity_threshold
+        for row in self.manager.connection.execute(
+                "SELECT normalized_prompt, prompt, timestamp FROM answer_cache "
+                "WHERE fingerprint = ? AND created_at >= ?",
+                (fingerprint, expire_time)):
+            # "buffer 100 meters" never replays the answer of "buffer 500 meters".
+            if self.prompt_identifiers(row["prompt"]) != identifiers:
+                continue
+
+            # jaccard similarity of words and character bigrams.
+            entry_features = self.prompt_features(row["prompt"])
+            union_count = len(features | entry_features)
+            similarity = len(features & entry_features) / union_count if union_count else 0
+            if similarity >= best_similarity:
+                best_row = row
+                best_similarity = similarity
+        return best_row
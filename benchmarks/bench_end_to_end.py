@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the client side of a chat.
+
+StreamChatWorker and ChatbotBrowser are driven headlessly against the local
+mock server, and for every answer size it reports:
+
+* time to first render, from sending the request to the first rendered content
+* render cost per streamed chunk
+* total busy time of the GUI thread
+* peak memory
+
+Run it with the Python of QGIS, the plugin is imported as a package:
+
+    python benchmarks/bench_end_to_end.py
+    python benchmarks/bench_end_to_end.py --sizes 1024 1048576 --images 4 --disconnect-after 50
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak RSS is not reported.
+    resource = None
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "chinese_ai_assistant"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockStreamServer  # noqa: E402
+
+
+def import_plugin(server_url):
+    """import the plugin directory as a package, the server must be set before importing."""
+    os.environ["CHINESE_AI_ASSISTANT_SERVER"] = server_url
+
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(PLUGIN_DIR, "__init__.py"), submodule_search_locations=[PLUGIN_DIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+
+    worker_module = importlib.import_module(PACKAGE_NAME + ".stream_chat_worker")
+    browser_module = importlib.import_module(PACKAGE_NAME + ".chatbot_browser")
+    return worker_module.StreamChatWorker, browser_module.ChatbotBrowser
+
+
+class MessageBar:
+
+    def pushMessage(self, message):
+        print("message:", message)
+
+
+class Interface:
+    """the part of QgisInterface used by the browser."""
+
+    def __init__(self):
+        self.message_bar = MessageBar()
+
+    def messageBar(self):
+        return self.message_bar
+
+
+def percentile(values, ratio):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def run_chat(app, worker_class, browser, render_times, render_interval):
+    """stream one answer into the browser, return the metrics."""
+    from PyQt5.QtCore import QTimer
+
+    browser.clear()
+    browser.render_interval = render_interval
+    browser.pre_process_markdown()
+    render_times.clear()
+
+    metrics = {"chunks": 0, "error": ""}
+    worker = worker_class({"prompt": "benchmark", "history": [], "workspace": {}}, 3, 100)
+    worker.content_received.connect(browser.append_markdown)
+    worker.content_received.connect(lambda content: metrics.__setitem__("chunks", metrics["chunks"] + 1))
+    worker.stream_ended.connect(lambda count: browser.post_process_markdown())
+    worker.error_occurred.connect(lambda error: metrics.__setitem__("error", error))
+    worker.finished.connect(app.quit)
+
+    # never wait forever for a broken stream.
+    QTimer.singleShot(120000, app.quit)
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    start_thread_time = time.thread_time()
+    metrics["start"] = start_time
+
+    worker.start()
+    app.exec_()
+
+    # the images arrive after the end of stream.
+    while browser.pending_images and time.perf_counter() - start_time < 120:
+        app.processEvents()
+        time.sleep(0.001)
+
+    metrics["total"] = time.perf_counter() - start_time
+    metrics["busy"] = time.thread_time() - start_thread_time
+    metrics["peak_python"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    metrics["first_render"] = render_times[0][0] - start_time if render_times else 0
+    metrics["render_costs"] = [cost for _, cost in render_times]
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 16 * 1024, 128 * 1024, 1024 * 1024],
+                        help="answer sizes in bytes")
+    parser.add_argument("--chunk-size", type=int, default=16, help="characters per event")
+    parser.add_argument("--token-rate", type=float, default=0, help="characters per second, 0 is unlimited")
+    parser.add_argument("--images", type=int, default=0, help="count of embedded images")
+    parser.add_argument("--disconnect-after", type=int, action="append", default=[])
+    parser.add_argument("--render-interval", type=int, default=50, help="milliseconds between renders")
+    parser.add_argument("--port", type=int, default=8799)
+    args = parser.parse_args()
+
+    if "QT_QPA_PLATFORM" not in os.environ:
+        os.environ["QT_QPA_PLATFORM"] = "offscreen"
+
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    server = MockStreamServer(args.port, args.token_rate, args.chunk_size,
+                              disconnect_after=args.disconnect_after).start()
+    worker_class, browser_class = import_plugin(server.base_url)
+
+    # time every render of the browser.
+    render_times = []
+
+    class TimedBrowser(browser_class):
+
+        def flush_markdown(self):
+            has_content = bool(self.pending_content)
+            start = time.perf_counter()
+            super().flush_markdown()
+            if has_content:
+                render_times.append((start, time.perf_counter() - start))
+
+    browser = TimedBrowser(Interface())
+    browser.resize(400, 800)
+    browser.show()
+
+    rss_header = f" {'rss MB':>7}" if resource is not None else ""
+    print(f"{'size':>9} {'chunks':>7} {'first ms':>9} {'renders':>8} {'ms/chunk':>9} {'p95 ms':>7} "
+          f"{'busy ms':>9} {'total ms':>9} {'py MB':>7}{rss_header}")
+    for size in args.sizes:
+        server.set_answer(size, args.images)
+        metrics = run_chat(app, worker_class, browser, render_times, args.render_interval)
+
+        chunks = max(1, metrics["chunks"])
+        peak_rss = ""
+        if resource is not None:
+            peak_rss = f" {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:>7.1f}"
+        print(f"{size:>9} {metrics['chunks']:>7} {metrics['first_render'] * 1000:>9.1f} "
+              f"{len(metrics['render_costs']):>8} {sum(metrics['render_costs']) * 1000 / chunks:>9.3f} "
+              f"{percentile(metrics['render_costs'], 0.95) * 1000:>7.2f} {metrics['busy'] * 1000:>9.1f} "
+              f"{metrics['total'] * 1000:>9.1f} {metrics['peak_python'] / 1048576:>7.1f}{peak_rss}")
+        if metrics["error"]:
+            print("error:", metrics["error"])
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the markdown post-processing regexes.
+
+The transforms applied by ChatbotBrowser are measured on realistic answers and
+on adversarial ones, the previous implementation with one re.sub per transform
+is kept here as the reference. Both make a single pass over the whole text,
+the current one leaves the tags in code spans and fences, which costs a few
+steps per line.
+
+The html tags are also stripped while the answer is streamed, measured apart on
+chunks of 16 characters: HtmlTagStripper scans every chunk once, the previous
+implementation cleaned the whole content on every chunk.
+
+Run it with pytest-benchmark, and compare the results between versions:
+
+    pytest benchmarks/bench_markdown.py --benchmark-autosave
+    pytest benchmarks/bench_markdown.py --benchmark-compare
+
+or without pytest, saving and comparing the results in a JSON file:
+
+    python benchmarks/bench_markdown.py --save .benchmarks/markdown.json
+    python benchmarks/bench_markdown.py --compare .benchmarks/markdown.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+# markdown_utils does not depend on QGIS, so it can be imported directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from markdown_utils import HtmlTagStripper, finalize_images, MARKDOWN_IMAGE_PATTERN  # noqa: E402
+from mock_server import build_answer  # noqa: E402
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+BASE_URL = "https://www.phoenix-gis.cn"
+
+
+def build_cases():
+    """name -> (markdown text, failed image URLs)."""
+    answer = build_answer(64 * 1024, 16, BASE_URL)
+    failed_images = {f"{BASE_URL}/images/{index}.png" for index in range(0, 16, 3)}
+
+    code_block = "```python\n" + "for feature in layer.getFeatures():\n    print(feature['name'] < 10)\n" * 4000 + "```\n"
+    links = "".join(f"* [链接{index}]({BASE_URL}/docs/{index}) ![图{index}]({BASE_URL}/images/{index}.png)\n"
+                    for index in range(3000))
+    html = "".join(f"<div class=\"note\">第{index}段 <b>重点</b><br/>内容</div>\n" for index in range(3000))
+
+    return {
+        "answer_64k": (answer, failed_images),
+        "code_block": (code_block, set()),
+        "links_3000": (links, {f"{BASE_URL}/images/{index}.png" for index in range(0, 3000, 2)}),
+        "html_3000": (html, set()),
+        # a tag is never closed, every "<" starts a match attempt.
+        "unclosed_tags": ("<a" * 20000, set()),
+        "stray_less_than": ("if a < b and c <d then " * 4000, set()),
+        "unclosed_images": ("![" * 20000, set()),
+    }
+
+
+CASES = build_cases()
+
+
+def legacy_post_process(markdown_text, failed_images):
+    """the previous implementation, every transform compiles its pattern and scans the whole text."""
+    markdown_text = re.sub(r'<\/?[a-zA-Z][^>]*>', '', markdown_text)
+    markdown_text = re.sub(r'\[upl-image-preview[^\]]*?url=([^\s\]]+)[^\]]*\]', r'\n\n![Image](\1)',
+                           markdown_text, flags=re.IGNORECASE)
+
+    def replace_match(match):
+        if match.group(2) in failed_images:
+            return f'[{match.group(1)}]({match.group(2)})'
+        return match.group(0)
+
+    markdown_text = re.sub(r'!\[([^\]]*)\]\(([^)]+)\)', replace_match, markdown_text)
+    re.findall(r'!\[[^\]]*\]\(([^)]+)\)', markdown_text)
+    return markdown_text
+
+
+def post_process(markdown_text, failed_images):
+    html_stripper = HtmlTagStripper()
+    markdown_text = html_stripper.feed(markdown_text) + html_stripper.flush()
+    markdown_text = finalize_images(markdown_text, failed_images)
+    [match.group(2) for match in MARKDOWN_IMAGE_PATTERN.finditer(markdown_text)]
+    return markdown_text
+
+
+TRANSFORMS = {
+    "legacy": legacy_post_process,
+    "current": post_process,
+}
+
+# the previous streaming cost is quadratic, so these answers are smaller.
+STREAM_CASES = {
+    "answer_16k": build_answer(16 * 1024, 4, BASE_URL),
+    "html_300": "".join(f"<div class=\"note\">第{index}段 <b>重点</b><br/>内容</div>\n" for index in range(300)),
+    "code_block_400": "```python\n" + "for feature in layer.getFeatures():\n    print(feature['name'] < 10)\n" * 200 + "```\n",
+}
+STREAM_CHUNK_SIZE = 16
+
+
+def legacy_strip_streamed(markdown_text):
+    """the previous clean_html_tag, run over the whole content on every chunk."""
+    content = ""
+    for index in range(0, len(markdown_text), STREAM_CHUNK_SIZE):
+        content += markdown_text[index:index + STREAM_CHUNK_SIZE]
+        content = re.sub(r'<\/?[a-zA-Z][^>]*>', '', content)
+    return content
+
+
+def strip_streamed(markdown_text):
+    html_stripper = HtmlTagStripper()
+    return "".join(html_stripper.feed(markdown_text[index:index + STREAM_CHUNK_SIZE])
+                   for index in range(0, len(markdown_text), STREAM_CHUNK_SIZE)) + html_stripper.flush()
+
+
+STREAM_TRANSFORMS = {
+    "legacy": legacy_strip_streamed,
+    "current": strip_streamed,
+}
+
+
+if pytest is not None:
+
+    @pytest.mark.parametrize("case", sorted(CASES))
+    @pytest.mark.parametrize("transform", sorted(TRANSFORMS))
+    def test_post_process(benchmark, transform, case):
+        markdown_text, failed_images = CASES[case]
+        benchmark(TRANSFORMS[transform], markdown_text, failed_images)
+
+    @pytest.mark.parametrize("case", sorted(STREAM_CASES))
+    @pytest.mark.parametrize("transform", sorted(STREAM_TRANSFORMS))
+    def test_strip_streamed(benchmark, transform, case):
+        benchmark(STREAM_TRANSFORMS[transform], STREAM_CASES[case])
+
+    @pytest.mark.parametrize("case", ["answer_64k", "links_3000"])
+    def test_same_output(case):
+        markdown_text, failed_images = CASES[case]
+        assert post_process(markdown_text, failed_images) == legacy_post_process(markdown_text, failed_images)
+
+
+def measure(function, *args, min_time=0.2):
+    """the best time of one call in milliseconds."""
+    best = float("inf")
+    total = 0
+    while total < min_time:
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with this JSON file")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f"{'case':>16} {'size':>9} {'legacy ms':>10} {'current ms':>11} {'baseline ms':>12}")
+    for case, (markdown_text, failed_images) in CASES.items():
+        legacy_time = measure(legacy_post_process, markdown_text, failed_images)
+        current_time = measure(post_process, markdown_text, failed_images)
+        results[case] = current_time
+
+        baseline_time = f"{baseline[case]:>12.3f}" if case in baseline else f"{'-':>12}"
+        print(f"{case:>16} {len(markdown_text):>9} {legacy_time:>10.3f} {current_time:>11.3f} {baseline_time}")
+
+    print(f"\nhtml tags stripped from chunks of {STREAM_CHUNK_SIZE} characters")
+    print(f"{'case':>16} {'size':>9} {'legacy ms':>10} {'current ms':>11} {'baseline ms':>12}")
+    for case, markdown_text in STREAM_CASES.items():
+        legacy_time = measure(legacy_strip_streamed, markdown_text)
+        current_time = measure(strip_streamed, markdown_text)
+        key = f"streamed/{case}"
+        results[key] = current_time
+
+        baseline_time = f"{baseline[key]:>12.3f}" if key in baseline else f"{'-':>12}"
+        print(f"{case:>16} {len(markdown_text):>9} {legacy_time:>10.3f} {current_time:>11.3f} {baseline_time}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the SSE parser.
+
+Feed event streams of growing size to SseParser in randomly sized packets,
+the throughput should stay flat as the stream grows.
+
+    python benchmarks/bench_sse_parser.py
+"""
+
+import json
+import os
+import random
+import sys
+import time
+
+# sse_parser does not depend on QGIS, so it can be imported directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_parser import SseParser  # noqa: E402
+
+
+def build_stream(size):
+    """build an event stream of about `size` bytes with multi-byte characters."""
+    parts = [b'data: {"type": "chunks", "content": 0}\n\n']
+    total = len(parts[0])
+    index = 0
+    while total < size:
+        content = f"第{index}段 chunk with **markdown** 和中文字符\n"
+        line = b"data: " + json.dumps({"type": "content", "content": content}, ensure_ascii=False).encode('utf-8') + b"\r\n\r\n"
+        parts.append(line)
+        total += len(line)
+        index += 1
+    parts.append(b'data: {"type": "end"}\n\n')
+    return b"".join(parts), index
+
+
+def split_packets(stream, rng, max_packet=4096):
+    """split the stream at random offsets, including inside multi-byte characters and CRLF."""
+    packets = []
+    position = 0
+    while position < len(stream):
+        size = rng.randint(1, max_packet)
+        packets.append(stream[position:position + size])
+        position += size
+    return packets
+
+
+def run(size_mb):
+    stream, content_count = build_stream(size_mb * 1024 * 1024)
+    packets = split_packets(stream, random.Random(size_mb))
+
+    parser = SseParser()
+    received = 0
+    start = time.perf_counter()
+    for packet in packets:
+        for event in parser.feed(packet):
+            if json.loads(event.data)["type"] == "content":
+                received += 1
+    elapsed = time.perf_counter() - start
+
+    assert received == content_count, (received, content_count)
+    assert parser.buffered_size == 0
+    return len(stream) / (1024 * 1024) / elapsed, len(packets)
+
+
+def main():
+    print(f"{'size':>6} {'packets':>9} {'MB/s':>8}")
+    for size_mb in (1, 4, 16):
+        throughput, packet_count = run(size_mb)
+        print(f"{size_mb:>4}MB {packet_count:>9} {throughput:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
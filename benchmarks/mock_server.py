@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the /ai/v1/chat/stream endpoint of the AI server.
+
+The answer is streamed as server-sent events in the format of the real server,
+with the rate, chunk size, answer size, embedded images and disconnects
+configurable. Point the plugin at it before QGIS starts:
+
+    python benchmarks/mock_server.py --port 8765 --answer-size 65536 --images 3
+    CHINESE_AI_ASSISTANT_SERVER=http://127.0.0.1:8765 qgis
+
+It depends on the standard library only.
+"""
+
+import argparse
+import gzip
+import json
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the text repeated to build the answer, with markdown and multi-byte characters.
+ANSWER_PARAGRAPHS = [
+    "## 使用 QGIS 进行缓冲区分析\n\n",
+    "在 **处理工具箱** 中搜索 `Buffer`，选择需要分析的图层并设置距离。\n\n",
+    "1. 打开图层属性\n2. 检查坐标参考系统\n3. 运行缓冲区工具\n\n",
+    "```python\nprocessing.run('native:buffer', {'INPUT': layer, 'DISTANCE': 100})\n```\n\n",
+    "> 投影坐标系下距离单位为米，地理坐标系下为度。\n\n",
+    "| 参数 | 说明 |\n| --- | --- |\n| DISTANCE | 缓冲距离 |\n| SEGMENTS | 分段数 |\n\n",
+]
+
+
+def build_answer(answer_size, image_count, base_url):
+    """build a markdown answer of about answer_size bytes with images spread in it."""
+    parts = []
+    size = 0
+    index = 0
+    while size < answer_size:
+        paragraph = ANSWER_PARAGRAPHS[index % len(ANSWER_PARAGRAPHS)]
+        parts.append(paragraph)
+        size += len(paragraph.encode('utf-8'))
+        index += 1
+
+    # the images are inserted between paragraphs, half of them in the knowledge database format.
+    for image_index in range(image_count):
+        position = (image_index + 1) * len(parts) // (image_count + 1)
+        url = f"{base_url}/images/{image_index}.png"
+        if image_index % 2:
+            image = f"[upl-image-preview uuid={image_index} url={url} align=center]\n\n"
+        else:
+            image = f"![截图{image_index}]({url})\n\n"
+        parts.insert(position, image)
+
+    return "".join(parts)
+
+
+def build_png(width, height, seed):
+    """an RGB PNG image of solid color, without any imaging library."""
+    color = bytes(((seed * 67) % 256, (seed * 131) % 256, (seed * 199) % 256))
+    raw = b"".join(b"\x00" + color * width for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(raw, 6)) +
+            chunk(b"IEND", b""))
+
+
+class MockStreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/ai/v1/chat/stream":
+            self._send_empty(404)
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        request_data = json.loads(body or b"{}")
+        self.server.requests.append({"size": len(body), "keys": sorted(request_data)})
+
+        # resume after the last received event.
+        last_event_id = self.headers.get("Last-Event-ID")
+        start_index = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        chunks = self.server.chunks
+        if start_index == 0:
+            self._send_event(None, {"type": "chunks", "content": "5"})
+
+        interval = self.server.chunk_size / self.server.token_rate if self.server.token_rate > 0 else 0
+        for index in range(start_index, len(chunks)):
+            self._send_event(index, {"type": "content", "content": chunks[index]})
+
+            # close the connection in the middle of answer, once per disconnect point.
+            if index in self.server.disconnect_points:
+                self.server.disconnect_points.discard(index)
+                self.close_connection = True
+                return
+
+            if interval:
+                time.sleep(interval)
+
+        self._send_event(None, {"type": "end"})
+        self._write_chunk(b"")
+
+    def do_GET(self):
+        # the embedded images.
+        if not self.path.startswith("/images/"):
+            self._send_empty(404)
+            return
+
+        image_index = int(self.path.rsplit("/", 1)[-1].split(".")[0])
+        image_data = build_png(self.server.image_size, self.server.image_size * 3 // 4, image_index)
+        etag = f'"{image_index}-{self.server.image_size}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._send_empty(304)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(image_data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(image_data)
+
+    def _send_event(self, event_id, event_data):
+        lines = []
+        if event_id is not None:
+            lines.append(f"id: {event_id}")
+        lines.append("data: " + json.dumps(event_data, ensure_ascii=False))
+        self._write_chunk(("\n".join(lines) + "\n\n").encode('utf-8'))
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_empty(self, status_code):
+        self.send_response(status_code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class MockStreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=8765, token_rate=0, chunk_size=16, answer_size=4096, images=0, image_size=800,
+                 disconnect_after=(), verbose=False):
+        super().__init__(("127.0.0.1", port), MockStreamHandler)
+        self.token_rate = token_rate
+        self.chunk_size = chunk_size
+        self.image_size = image_size
+        self.verbose = verbose
+        self.requests = []
+        self.chunks = []
+        self.disconnect_after = list(disconnect_after)
+        self.disconnect_points = set()
+        self.set_answer(answer_size, images)
+
+    def set_answer(self, answer_size, images=0):
+        """build the answer streamed by the next requests, the disconnect points are armed again."""
+        answer = build_answer(answer_size, images, self.base_url)
+        self.chunks = [answer[i:i + self.chunk_size] for i in range(0, len(answer), self.chunk_size)]
+        self.disconnect_points = set(self.disconnect_after)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """serve in a daemon thread, return self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token-rate", type=float, default=200,
+                        help="characters per second, 0 streams as fast as possible")
+    parser.add_argument("--chunk-size", type=int, default=16, help="characters per event")
+    parser.add_argument("--answer-size", type=int, default=4096, help="bytes of the answer")
+    parser.add_argument("--images", type=int, default=0, help="count of embedded images")
+    parser.add_argument("--image-size", type=int, default=800, help="width of images in pixels")
+    parser.add_argument("--disconnect-after", type=int, action="append", default=[],
+                        help="close the connection after this event once, could be repeated")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = MockStreamServer(args.port, args.token_rate, args.chunk_size, args.answer_size, args.images,
+                              args.image_size, args.disconnect_after, args.verbose)
+    print(f"Streaming {len(server.chunks)} events on {server.base_url}/ai/v1/chat/stream")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
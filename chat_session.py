@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                                  Chat Session
+  A conversation shown in its own tab, and the scheduler of their requests.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import time
+from collections import deque
+
+from qgis.PyQt.QtCore import QObject, pyqtSignal
+
+from .chat_timing import ChatTiming
+from .chatbot_browser import ChatbotBrowser
+from .conversation_state import ConversationState
+from .stream_chat_worker import StreamChatWorker
+
+
+class ChatSession(QObject):
+    """
+    Keep the browser, the stream and the history chain of one conversation,
+    so that several conversations could be answered at the same time.
+    """
+
+    IDLE = 0
+    QUEUED = 1
+    RUNNING = 2
+
+    # the state or title of session changed.
+    state_changed = pyqtSignal()
+    # the request is finished, aborted or failed, the parameter is the session itself.
+    finished = pyqtSignal(object)
+    # the connection is lost, the parameters are the attempt and the delay in milliseconds.
+    retrying = pyqtSignal(int, int)
+
+    def __init__(self, iface, history_manager, answer_cache, parent=None):
+        super().__init__(parent)
+        self.history_manager = history_manager
+        self.answer_cache = answer_cache
+
+        self.browser = ChatbotBrowser(iface)
+        # use custom function to deal with "Open Links".
+        self.browser.setOpenLinks(False)
+
+        self.state = self.IDLE
+        self.worker = None
+        self.request_data = None
+        self.fallback_request_data = None
+        self.compress = False
+        self.max_retries = 3
+        self.retry_delay = 500
+
+        self.question = ""
+        self.chat_id = None
+        self.pre_chat_timestamp = 0
+        # the server has sent some content of current answer.
+        self.answer_received = False
+
+        # the latest answer of this session, and the chat it follows.
+        self.last_chat_timestamp = 0
+        self.last_pre_chat_timestamp = 0
+
+        # the question and workspace fingerprint of current chat, if its answer could be cached.
+        self.answer_cache_key = None
+
+        # the history and workspace kept by the server in conversation state mode.
+        self.conversation_state = ConversationState()
+
+        # the timing record of current chat, shared with the browser and the worker.
+        self.timing = ChatTiming()
+
+    def title(self):
+        """the first line of question, shortened to fit in a tab."""
+        title = self.question.strip().split('\n')[0]
+        return title[:16] + "…" if len(title) > 16 else title
+
+    def is_busy(self):
+        return self.state != self.IDLE
+
+    def reset(self):
+        self.browser.clear()
+        self.question = ""
+        self.chat_id = None
+        self.pre_chat_timestamp = 0
+        self.last_chat_timestamp = 0
+        self.answer_cache_key = None
+        self.conversation_state.reset()
+        self.state_changed.emit()
+
+    def show_question(self, question: str):
+        # In order to  make the markdown render faster, we have to clear the previous markdown content.
+        self.browser.clear()
+
+        self.question = question
+        self.answer_received = False
+        self.browser.pre_process_markdown()
+        self.browser.append_markdown(self.tr("**Question:") + question + "**\n\n")
+        self.browser.append_markdown(self.tr("**Answer:") + "**\n\n")
+        self.state_changed.emit()
+
+    def show_history(self, history_item):
+        self.browser.clear()
+        self.question = history_item["question"]
+        self.chat_id = None
+        self.pre_chat_timestamp = history_item.get("timestamp", 0)
+        self.last_chat_timestamp = 0
+        self.conversation_state.reset()
+        self.browser.pre_process_markdown()
+        self.browser.append_markdown(history_item["answer"], scroll_to_bottom=False)
+        self.browser.post_process_markdown(show_feedback=False)
+        self.state_changed.emit()
+
+    def replay_answer(self, history_item, note):
+        """show the cached answer through the same rendering path."""
+        self.answer_cache_key = None
+        self.chat_id = None
+        self.pre_chat_timestamp = history_item["timestamp"]
+        self.last_chat_timestamp = 0
+        self.conversation_state.reset()
+
+        self.browser.append_markdown(history_item["answer"])
+        self.browser.append_markdown("\n\n" + note)
+        self.browser.post_process_markdown(show_feedback=False)
+
+        # the replayed chat is logged as the answered one.
+        self.timing.mark("finished")
+        self.finished.emit(self)
+
+    def start_timing(self):
+        """a new timing record for the chat about to begin."""
+        self.timing = ChatTiming(self.chat_id or "")
+        self.browser.timing = self.timing
+
+    def set_request(self, request_data, max_retries, retry_delay, compress=False, fallback_request_data=None):
+        """the request is sent once the scheduler starts the session."""
+        self.request_data = request_data
+        self.fallback_request_data = fallback_request_data
+        self.compress = compress
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    def set_state(self, state):
+        self.state = state
+        self.state_changed.emit()
+
+    def start(self):
+        self.worker = StreamChatWorker(self.request_data, self.max_retries, self.retry_delay, self,
+                                       compress=self.compress, fallback_request_data=self.fallback_request_data)
+        self.worker.content_received.connect(self.on_content_received)
+        self.worker.stream_ended.connect(self.on_stream_ended)
+        self.worker.error_occurred.connect(self.on_error_occurred)
+        self.worker.retrying.connect(self.retrying)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.worker.timing = self.timing
+        self.timing.mark("dispatched")
+
+        self.set_state(self.RUNNING)
+        self.worker.start()
+
+    def stop(self):
+        # abort the request immediately.
+        if self.worker:
+            self.worker.stop()
+
+        # no feedback on the answer never received, such as the one of a queued session.
+        self.browser.post_process_markdown(show_feedback=self.answer_received)
+
+    def on_content_received(self, content):
+        """receive the streaming message."""
+        # append every message to the chatbot browser.
+        self.answer_received = True
+        self.browser.append_markdown(content)
+
+    def on_stream_ended(self, chunk_count):
+        self.browser.post_process_markdown()
+
+        # save to history
+        cur_chat_timestamp = self._new_timestamp()
+        self.history_manager.put_history(
+            cur_chat_timestamp,
+            self.pre_chat_timestamp,
+            self.question,
+            self.browser.get_raw_markdown_content())
+
+        # the server keeps this turn of conversation.
+        self.conversation_state.acknowledge()
+
+        # remember the answer of the question without context.
+        if self.answer_cache_key:
+            self.answer_cache.put(*self.answer_cache_key, cur_chat_timestamp)
+            self.answer_cache_key = None
+
+        # current chat will be the next previous chat.
+        self.last_chat_timestamp = cur_chat_timestamp
+        self.last_pre_chat_timestamp = self.pre_chat_timestamp
+        self.pre_chat_timestamp = cur_chat_timestamp
+
+    def on_error_occurred(self, error_msg):
+        """deal with errors"""
+        # show errors in chatbot.
+        self.browser.append_markdown(error_msg)
+        self.browser.flush_markdown()
+
+    def on_worker_finished(self):
+        self.timing.mark("finished")
+        self.worker.deleteLater()
+        self.worker = None
+        self.set_state(self.IDLE)
+        self.finished.emit(self)
+
+    def _new_timestamp(self):
+        """
+        The timestamp is the key of history, concurrent sessions may end in
+        the same second, so take the next free one.
+        """
+        timestamp = int(time.time())
+        while self.history_manager.has_history(timestamp):
+            timestamp += 1
+        return timestamp
+
+
+class ChatScheduler(QObject):
+    """Run at most max_in_flight sessions at the same time, the others wait in FIFO order."""
+
+    def __init__(self, max_in_flight=2, parent=None):
+        super().__init__(parent)
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue = deque()
+        self.running = set()
+
+    def set_max_in_flight(self, max_in_flight):
+        self.max_in_flight = max(1, max_in_flight)
+        self._dispatch()
+
+    def submit(self, session: ChatSession):
+        self.queue.append(session)
+        session.set_state(ChatSession.QUEUED)
+        self._dispatch()
+
+    def cancel(self, session: ChatSession):
+        """remove the session waiting in queue, the running one is stopped by itself."""
+        if session in self.queue:
+            self.queue.remove(session)
+            session.set_state(ChatSession.IDLE)
+
+    def remove(self, session: ChatSession):
+        """forget the closed session."""
+        self.cancel(session)
+        self.running.discard(session)
+        self._dispatch()
+
+    def queue_position(self, session: ChatSession):
+        return self.queue.index(session) + 1 if session in self.queue else 0
+
+    def on_session_finished(self, session):
+        self.running.discard(session)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.queue and len(self.running) < self.max_in_flight:
+            session = self.queue.popleft()
+            self.running.add(session)
+            session.start()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                                  Chat Timing
+  Where the time of a chat is spent: the plugin, the network or the server.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from PyQt5.QtCore import QStandardPaths
+
+
+class ChatTiming:
+    """
+    The timing record of one chat, all times are in milliseconds.
+
+    Marks are the first moment an event happens, counted from the start of chat.
+    Spans are durations which may happen many times, such as renders and event
+    parsing, their count, total and max are kept. Counters are plain numbers.
+    """
+
+    def __init__(self, chat_id=""):
+        self.chat_id = chat_id
+        self.created = time.time()
+        self.start_time = time.perf_counter()
+        self.marks = {}
+        # name -> [count, total, max]
+        self.spans = {}
+        self.counters = {}
+
+    def elapsed(self):
+        return (time.perf_counter() - self.start_time) * 1000
+
+    def mark(self, name):
+        """remember the first time of the event only."""
+        if name not in self.marks:
+            self.marks[name] = self.elapsed()
+
+    def add_span(self, name, duration):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [1, duration, duration]
+        else:
+            span[0] += 1
+            span[1] += duration
+            span[2] = max(span[2], duration)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, (time.perf_counter() - start) * 1000)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "chat_id": self.chat_id,
+            "created": self.created,
+            "marks": {name: round(value, 3) for name, value in self.marks.items()},
+            "spans": {name: {"count": count, "total": round(total, 3), "max": round(maximum, 3)}
+                      for name, (count, total, maximum) in self.spans.items()},
+            "counters": dict(self.counters)
+        }
+
+    def summary(self):
+        """a few lines for the overlay."""
+        lines = [" ".join(f"{name} {value:.0f}" for name, value in self.marks.items())]
+        for name, (count, total, maximum) in self.spans.items():
+            lines.append(f"{name}: {total:.1f} ms / {count}, max {maximum:.1f}")
+        if self.counters:
+            lines.append(" ".join(f"{name} {value}" for name, value in self.counters.items()))
+        return "\n".join(lines)
+
+    def append_to_log(self):
+        """append the record as one line of JSON, for offline analysis."""
+        try:
+            os.makedirs(os.path.dirname(self.log_file_path()), exist_ok=True)
+            with open(self.log_file_path(), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self.to_dict()) + "\n")
+        except (IOError, OSError):
+            pass
+
+    @staticmethod
+    def log_file_path():
+        temp_dir = QStandardPaths.writableLocation(QStandardPaths.TempLocation)
+        return os.path.join(temp_dir, "qgis-chinese-ai-assistant-timing.jsonl")
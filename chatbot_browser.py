@@ -19,20 +19,38 @@
  ***************************************************************************/
 """
 
+import time
 import webbrowser
-import re
-from threading import Lock
+from collections import deque
+from functools import partial
 
 from PyQt5.QtCore import QByteArray, Qt, QUrl, pyqtSignal, QTimer
-from PyQt5.QtGui import QTextDocument, QImage, QMouseEvent
-from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
+from PyQt5.QtGui import (QTextDocument, QMouseEvent, QTextCursor, QTextDocumentFragment,
+                         QTextBlockFormat, QTextCharFormat, QTextListFormat)
+from PyQt5.QtNetwork import QNetworkRequest, QNetworkReply
 from PyQt5.QtWidgets import QTextBrowser
 
+from .markdown_utils import (MarkdownBlockSplitter, ImageUrlScanner, HtmlTagStripper, finalize_images,
+                             MARKDOWN_IMAGE_PATTERN)
+from .chat_timing import ChatTiming
+from .network_client import NetworkClient
+from .image_cache import ImageCache, ImageDecodeTask
+
 
 class ChatbotBrowser(QTextBrowser):
+    # the styles of list numbered by the position of items.
+    ORDERED_LIST_STYLES = (QTextListFormat.ListDecimal, QTextListFormat.ListLowerAlpha, QTextListFormat.ListUpperAlpha,
+                           QTextListFormat.ListLowerRoman, QTextListFormat.ListUpperRoman)
+
+    # the max count of images downloaded at the same time.
+    MAX_CONCURRENT_DOWNLOADS = 4
+    # the images failed after the answer is rendered are turned into links together after this delay.
+    FAILED_IMAGES_DELAY = 300
+
     show_setting_dlg = pyqtSignal()
     trigger_feedback = pyqtSignal(int)
     trigger_repeat = pyqtSignal()
+    trigger_refresh = pyqtSignal()
 
     def __init__(self, iface, parent=None):
         super().__init__(parent)
@@ -41,19 +59,54 @@ class ChatbotBrowser(QTextBrowser):
         self.auto_scroll_to_bottom = True
         self.setMouseTracking(True)
 
-        # Use a dictionary to cache downloaded images to prevent multiple downloads
-        self.image_cache = {}
-
-        # pending loading parameters.
+        # finished blocks are rendered only once, only the trailing open block is re-rendered.
+        self.block_splitter = MarkdownBlockSplitter()
+        self.committed_length = 0
+        self.committed_position = 0
+        self.document().setUndoRedoEnabled(False)
+
+        # html tags are removed from the streamed content chunk by chunk.
+        self.html_stripper = HtmlTagStripper()
+
+        # coalesce the streamed content and render it at most once every render_interval ms.
+        self.render_interval = 50
+        self.pending_content = ""
+        self.pending_scroll_to_bottom = True
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self.flush_markdown)
+
+        # the images are cached on disk and in memory, and shared by all browsers.
+        self.image_cache = ImageCache.instance()
+        self.failed_images = set()
+
+        # images are downloaded as soon as their URLs are streamed.
+        self.image_scanner = ImageUrlScanner()
         self.pending_images = set()
-        self.waiting_timer = QTimer(self)
-        self.waiting_timer.timeout.connect(self._finalize_markdown_display)
-
-        self.network_manager = QNetworkAccessManager(self)
-        self.network_manager.finished.connect(self._on_image_downloaded)
-
-        # prevent append content in multithread.
-        self.content_lock = Lock()
+        self.download_queue = deque()
+        # the running replies are referenced here, so they are never collected before finishing.
+        self.image_replies = {}
+
+        # images are decoded and scaled in the thread pool, the signals of running tasks are kept here.
+        self.decode_signals = {}
+        self.displayed_images = set()
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.timeout.connect(self._rescale_images)
+        self.failed_images_timer = QTimer(self)
+        self.failed_images_timer.setSingleShot(True)
+        self.failed_images_timer.timeout.connect(self._link_failed_images)
+
+        # the answer has been post processed.
+        self.finalized = False
+
+        # the timing record of current chat, the session replaces it for every chat.
+        self.timing = ChatTiming()
+        # url -> start time of the running download or decoding of image.
+        self.image_start_times = {}
+
+        # share connections with the other requests of plugin.
+        self.network_manager = NetworkClient.instance().network_manager
 
         self.anchorClicked.connect(self.handle_click_chatbot_anchor)
 
@@ -65,108 +118,108 @@ class ChatbotBrowser(QTextBrowser):
         """
         if type == QTextDocument.ImageResource and name.scheme() in ('http', 'https'):
             url_string = name.toString()
-            # Check if the image is already in the cache
-            if url_string in self.image_cache:
-                return self.image_cache[url_string]
-
-            # Check whether in pending list.
-            if url_string in self.pending_images:
-                return None
-
-            self._download_image_async(url_string)
-
-            return None
+            self.displayed_images.add(url_string)
+            return self._request_image(url_string)
 
         # Do not load unknown format of resource.
         return None
 
     def append_markdown(self, content: str, scroll_to_bottom=True):
-        # acquire lock
-        if not self.content_lock.acquire(blocking=False):
-            # only append to variable without really drawing it.
-            self.markdown_content += content
+        # start downloading the images before they are rendered.
+        for url_string in self.image_scanner.feed(content):
+            self._request_image(url_string)
+
+        # buffer content until the next flush.
+        self.pending_content += content
+        self.pending_scroll_to_bottom = scroll_to_bottom
+
+        # render immediately when a block is finished, otherwise wait for the timer.
+        if self.render_interval <= 0 or "\n\n" in self.pending_content[-len(content) - 1:]:
+            self.flush_markdown()
+        elif not self.render_timer.isActive():
+            self.render_timer.start(self.render_interval)
+
+    def flush_markdown(self):
+        """render all buffered content."""
+        self.render_timer.stop()
+        if not self.pending_content:
             return
 
-        try:
-            # save current scroll value.
-            scrollbar = self.verticalScrollBar()
-            current_scroll_value = scrollbar.value()
+        content = self.html_stripper.feed(self.pending_content)
+        scroll_to_bottom = self.pending_scroll_to_bottom
+        self.pending_content = ""
 
-            self.markdown_content += content
+        # save current scroll value.
+        scrollbar = self.verticalScrollBar()
+        current_scroll_value = scrollbar.value()
 
-            # clean all html tags
-            self.markdown_content = self.clean_html_tag(self.markdown_content)
+        self.markdown_content += content
 
-            # update markdown content
-            self.setMarkdown(self.markdown_content)
+        # update markdown content
+        with self.timing.span("render"):
+            self._render_incremental()
+        self.timing.mark("first_render")
 
-            if scroll_to_bottom and self.auto_scroll_to_bottom:
-                self.scroll_to_bottom()
-            else:
-                # resume scroll bar value and disable auto scrolling to bottom.
-                scrollbar.setValue(current_scroll_value)
-                self.auto_scroll_to_bottom = False
-        finally:
-            # release lock
-            self.content_lock.release()
+        if scroll_to_bottom and self.auto_scroll_to_bottom:
+            self.scroll_to_bottom()
+        else:
+            # resume scroll bar value and disable auto scrolling to bottom.
+            scrollbar.setValue(current_scroll_value)
+            self.auto_scroll_to_bottom = False
 
     def pre_process_markdown(self):
         # resume auto scroll to bottom.
         self.auto_scroll_to_bottom = True
-        self.pending_images.clear()
-        self.waiting_timer.stop()
+        self.finalized = False
 
     def post_process_markdown(self, show_feedback=True):
+        # render the buffered content first.
+        self.flush_markdown()
+
+        # the tail held back by the html stripper is not a tag.
+        self.markdown_content += self.html_stripper.flush()
+
         # add feedback
         if show_feedback:
             self.markdown_content += "\n\n" + self.feedback_text
 
         self.markdown_content += self.tail_splited_line
 
-        # deal with upl-image-preview block.
-        self.markdown_content = self.convert_upl_to_markdown_image(self.markdown_content)
+        # deal with upl-image-preview block, and replace failed image with links, in one pass.
+        self.markdown_content = finalize_images(self.markdown_content, self.failed_images)
 
-        # replace failed image with links.
-        self.markdown_content = self.replace_failed_images_with_links(self.markdown_content)
-
-        # wait for finalizing.
-        self.waiting_timer.start(500)
+        # the images still downloading are refreshed one by one when they arrive.
+        self.finalized = True
+        self._finalize_markdown_display()
 
         # Check Result!
         # self.iface.messageBar().pushMessage(self.markdown_content)
 
-    def replace_failed_images_with_links(self, markdown_text):
-        # Markdown format: ![alt](url)
-        pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-
-        def replace_match(match):
-            alt_text = match.group(1)
-            url = match.group(2)
-
-            if url in self.image_cache and self.image_cache[url] is None:
-                # replace to href.
-                return f'[{alt_text}]({url})'
-            else:
-                # keep strings.
-                return match.group(0)
-
-        return re.sub(pattern, replace_match, markdown_text)
-
-    def clean_html_tag(self, markdown_text):
-        return re.sub(r'<\/?[a-zA-Z][^>]*>', '', markdown_text)
-
     def clear(self):
+        self.pending_content = ""
+        self.render_timer.stop()
+        self.failed_images_timer.stop()
         self.markdown_content = ""
         self.setMarkdown("")
-        self.image_cache.clear()
+        self._reset_incremental_state()
+        self.html_stripper.reset()
+        self.failed_images.clear()
+        self.displayed_images.clear()
+        self.image_scanner.reset()
         self.auto_scroll_to_bottom = True
-        self.pending_images.clear()
-        self.waiting_timer.stop()
+        self.finalized = False
 
     def scroll_to_bottom(self):
         scrollbar = self.verticalScrollBar()
         scrollbar.setValue(scrollbar.maximum())
 
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+
+        # scale the images to the new width once resizing stops.
+        if event.size().width() != event.oldSize().width():
+            self.resize_timer.start(200)
+
     def wheelEvent(self, event):
         # forbid auto scroll to bottom
         self.auto_scroll_to_bottom = False
@@ -182,28 +235,42 @@ class ChatbotBrowser(QTextBrowser):
                 self.trigger_feedback.emit(int(link.path()[1:]))
             elif process_name == "repeat":
                 self.trigger_repeat.emit()
+            elif process_name == "refresh":
+                self.trigger_refresh.emit()
             return
 
         # open web browser
         url_str = link.url()
         webbrowser.open(url_str)
 
-    def convert_upl_to_markdown_image(self, markdown_text):
-        # regex: [upl-image-preview ...]
-        pattern = r'\[upl-image-preview[^\]]*?url=([^\s\]]+)[^\]]*\]'
-        converted_text = re.sub(pattern, r'\n\n![Image](\1)', markdown_text, flags=re.IGNORECASE)
-        return converted_text
+    def unload(self):
+        """stop the image downloads and decoding before the browser is deleted, their callbacks would find it gone."""
+        self.render_timer.stop()
+        self.resize_timer.stop()
+        self.failed_images_timer.stop()
+
+        self.download_queue.clear()
+        for reply in self.image_replies.values():
+            # abort() emits finished at once, so disconnect first.
+            reply.finished.disconnect()
+            reply.abort()
+            reply.deleteLater()
+        self.image_replies.clear()
+
+        for signals in self.decode_signals.values():
+            signals.decoded.disconnect(self._on_image_decoded)
+            signals.failed.disconnect(self._on_image_decode_failed)
+        self.decode_signals.clear()
+        self.pending_images.clear()
 
     def get_raw_markdown_content(self):
-        self.content_lock.acquire()
-        try:
-            # return the whole content without feedback and tail text.
-            ret_content = self.markdown_content
-            ret_content = ret_content.replace(self.feedback_text, "")
-            ret_content = ret_content.replace(self.tail_splited_line, "")
-            return ret_content
-        finally:
-            self.content_lock.release()
+        self.flush_markdown()
+
+        # return the whole content without feedback and tail text.
+        ret_content = self.markdown_content
+        ret_content = ret_content.replace(self.feedback_text, "")
+        ret_content = ret_content.replace(self.tail_splited_line, "")
+        return ret_content
 
     def mousePressEvent(self, event: QMouseEvent):
         # forbid auto scroll to bottom
@@ -279,87 +346,343 @@ class ChatbotBrowser(QTextBrowser):
             else:
                 # Try to find the original URL in the markdown content
                 # Look for markdown image syntax with this URL
-                pattern = r'!\[[^\]]*\]\(([^)]+)\)'
-                matches = re.findall(pattern, self.markdown_content)
-
-                for match in matches:
-                    if url_str in match or match in url_str:
-                        webbrowser.open(match)
+                for match in MARKDOWN_IMAGE_PATTERN.finditer(self.markdown_content):
+                    url = match.group(2)
+                    if url_str in url or url in url_str:
+                        webbrowser.open(url)
                         return
         except Exception as e:
             # show error message.
             error_msg = f"Error in _handle_image_click: {e}"
             self.iface.messageBar().pushMessage(error_msg)
 
-    def _download_image_async(self, url_string):
+    def _request_image(self, url_string):
+        """return the image if it is cached, otherwise start downloading it and return None."""
+        # Check if the image is already decoded, the image of another width is scaled again later.
+        cached_images = self.image_cache.memory.get(url_string)
+        if cached_images is not None:
+            original, image = cached_images
+            if image.width() != min(original.width(), self._available_image_width()):
+                self._decode_image_async(url_string, original=original)
+            return image
+
+        # Check whether in pending list.
+        if url_string in self.pending_images or url_string in self.failed_images:
+            return None
+
+        # Check if the image file is downloaded, the stale one is revalidated first.
+        entry, image_data = self.image_cache.disk.get(url_string)
+        if entry is not None and self.image_cache.disk.is_fresh(entry):
+            self.pending_images.add(url_string)
+            self._decode_image_async(url_string, image_data=image_data)
+            return None
+
+        self._download_image_async(url_string, entry)
+        return None
+
+    def _download_image_async(self, url_string, entry=None):
         if url_string in self.pending_images:
             return
 
         self.pending_images.add(url_string)
 
+        # wait in queue if too many images are downloading.
+        if len(self.image_replies) >= self.MAX_CONCURRENT_DOWNLOADS:
+            self.download_queue.append((url_string, entry))
+            return
+        self._start_download(url_string, entry)
+
+    def _start_download(self, url_string, entry):
         # build request
         request = QNetworkRequest(QUrl(url_string))
         request.setTransferTimeout(1000)
-        self.network_manager.get(request)
 
-    def _on_image_downloaded(self, reply):
+        # ask the server whether the cached file is modified.
+        if entry is not None:
+            if entry.get("etag"):
+                request.setRawHeader(b"If-None-Match", entry["etag"].encode('latin-1'))
+            if entry.get("last_modified"):
+                request.setRawHeader(b"If-Modified-Since", entry["last_modified"].encode('latin-1'))
+
+        reply = self.network_manager.get(request)
+        reply.finished.connect(partial(self._on_image_downloaded, url_string, reply))
+        self.image_replies[url_string] = reply
+        self.image_start_times[url_string] = time.perf_counter()
+
+    def _on_image_downloaded(self, url_string, reply):
         """deal with downloaded image."""
-        url_string = reply.url().toString()
+        image_data = self._read_image_reply(url_string, reply)
+        reply.deleteLater()
+        self._add_image_span("image_download", url_string)
 
-        # remove from pending list.
-        if url_string in self.pending_images:
-            self.pending_images.remove(url_string)
+        # start the next download.
+        self.image_replies.pop(url_string, None)
+        while self.download_queue and len(self.image_replies) < self.MAX_CONCURRENT_DOWNLOADS:
+            self._start_download(*self.download_queue.popleft())
 
+        # the image keeps pending until it is decoded.
+        if image_data is None:
+            self.pending_images.discard(url_string)
+        else:
+            self.timing.count("image_bytes", len(image_data))
+            self._decode_image_async(url_string, image_data=image_data)
+
+    def _read_image_reply(self, url_string, reply):
+        """return the image data to decode, or None if it is failed."""
         # deal with errors.
         error = reply.error()
         if error != QNetworkReply.NoError:
-            self._handle_download_error(url_string, reply.errorString())
-            reply.deleteLater()
-            return
+            # the stale file is better than nothing.
+            _, image_data = self.image_cache.disk.get(url_string)
+            if image_data is None:
+                self._handle_download_error(url_string, reply.errorString())
+            return image_data
+
+        # the cached file is not modified.
+        if reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 304:
+            _, image_data = self.image_cache.disk.get(url_string)
+            if image_data is None:
+                self._handle_download_error(url_string, "Invalid cached image")
+            else:
+                self.image_cache.disk.mark_validated(url_string)
+            return image_data
 
         # read data into memory.
         image_data = reply.readAll()
         if image_data.isEmpty():
             self._handle_download_error(url_string, "Empty response")
-            reply.deleteLater()
-            return
-
-        # load data as image.
-        image = QImage()
-        image.loadFromData(image_data)
+            return None
 
-        # shrink the large image
-        available_width = self.size().width()
-        if image.width() > available_width:
-            scaled_image = image.scaledToWidth(available_width, Qt.SmoothTransformation)
-        else:
-            scaled_image = image
+        # the file is removed if it turns out not to be an image.
+        self.image_cache.disk.put(
+            url_string,
+            image_data.data(),
+            etag=bytes(reply.rawHeader(b"ETag")).decode('latin-1'),
+            last_modified=bytes(reply.rawHeader(b"Last-Modified")).decode('latin-1'))
+        return image_data.data()
+
+    def _decode_image_async(self, url_string, image_data=None, original=None):
+        """decode the data or scale the original to the current width in the thread pool."""
+        if url_string in self.decode_signals:
+            return
 
-        # save to cache.
-        self.image_cache[url_string] = scaled_image
-        reply.deleteLater()
+        task = ImageDecodeTask(url_string, self._available_image_width(), image_data, original)
+        task.signals.decoded.connect(self._on_image_decoded)
+        task.signals.failed.connect(self._on_image_decode_failed)
+        self.decode_signals[url_string] = task.signals
+        self.image_start_times[url_string] = time.perf_counter()
+        self.image_cache.decode(task)
+
+    def _on_image_decoded(self, url_string, width, original, image):
+        self.decode_signals.pop(url_string, None)
+        self._add_image_span("image_decode", url_string)
+        self.pending_images.discard(url_string)
+        self.image_cache.memory.put(url_string, original, image)
+
+        # the browser is resized during scaling.
+        if image.width() != min(original.width(), self._available_image_width()):
+            self._decode_image_async(url_string, original=original)
+
+        if url_string in self.displayed_images:
+            # replace the image in the document, the previous one may be cached by the document.
+            self.document().addResource(QTextDocument.ImageResource, QUrl(url_string), image)
+            self._refresh_image(url_string)
+
+    def _on_image_decode_failed(self, url_string, width):
+        self.decode_signals.pop(url_string, None)
+        self._add_image_span("image_decode", url_string)
+        self.pending_images.discard(url_string)
+        self.image_cache.disk.remove(url_string)
+        self._handle_download_error(url_string, "Invalid image")
+
+    def _add_image_span(self, name, url_string):
+        start_time = self.image_start_times.pop(url_string, None)
+        if start_time is not None:
+            self.timing.add_span(name, (time.perf_counter() - start_time) * 1000)
+
+    def _rescale_images(self):
+        """scale the shown images to the current width from their originals."""
+        available_width = self._available_image_width()
+        for url_string in self.displayed_images:
+            cached_images = self.image_cache.memory.get(url_string)
+            if cached_images is None:
+                continue
+
+            original, image = cached_images
+            if image.width() != min(original.width(), available_width):
+                self._decode_image_async(url_string, original=original)
+
+    def _available_image_width(self):
+        return max(1, int(self.viewport().width() - 2 * self.document().documentMargin()))
+
+    def _refresh_image(self, url_string):
+        """layout the fragments showing the image again, instead of rendering the whole document."""
+        document = self.document()
+        refreshed = False
+        block = document.begin()
+        while block.isValid():
+            iterator = block.begin()
+            while not iterator.atEnd():
+                fragment = iterator.fragment()
+                char_format = fragment.charFormat()
+                if char_format.isImageFormat() and char_format.toImageFormat().name() == url_string:
+                    document.markContentsDirty(fragment.position(), fragment.length())
+                    refreshed = True
+                iterator += 1
+            block = block.next()
+
+        if refreshed and self.auto_scroll_to_bottom:
+            self.scroll_to_bottom()
 
     def _handle_download_error(self, url_string, error_msg):
         """deal with errors"""
-        # save None to the image_cache
-        self.image_cache[url_string] = None
+        # remember the failure, the image will be shown as a link.
+        self.failed_images.add(url_string)
 
         # show error on message bar.
         error_msg_display = f"Error loading image: {url_string}: {error_msg}"
         self.iface.messageBar().pushMessage(error_msg_display)
 
-    def _finalize_markdown_display(self):
-        if len(self.pending_images) > 0:
-            return
+        # the answer has been rendered, show the failed images as links in one render.
+        if self.finalized and not self.failed_images_timer.isActive():
+            self.failed_images_timer.start(self.FAILED_IMAGES_DELAY)
 
-        current_scroll_value = self.verticalScrollBar().value()
+    def _link_failed_images(self):
+        if self.finalized:
+            self.markdown_content = finalize_images(self.markdown_content, self.failed_images)
+            self._finalize_markdown_display()
 
-        self.waiting_timer.stop()
+    def _finalize_markdown_display(self):
+        current_scroll_value = self.verticalScrollBar().value()
 
         # finally update markdown
-        self.setMarkdown(self.markdown_content)
+        with self.timing.span("final_render"):
+            self.setMarkdown(self.markdown_content)
+        self._reset_incremental_state()
 
         if self.auto_scroll_to_bottom:
             self.scroll_to_bottom()
         else:
             self.verticalScrollBar().setValue(current_scroll_value)
+
+    def _render_incremental(self):
+        """commit the finished blocks and re-render the trailing open block only."""
+        self.block_splitter.feed(self.markdown_content)
+
+        # remove the previous rendering of the open block.
+        cursor = QTextCursor(self.document())
+        cursor.setPosition(self.committed_position)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        self._begin_open_block(cursor)
+
+        # render the newly finished blocks once.
+        for segment_end, kind in self.block_splitter.take_segments():
+            segment_text = self.markdown_content[self.committed_length:segment_end]
+            if kind == MarkdownBlockSplitter.CODE_LINES:
+                self._insert_code_lines(cursor, segment_text)
+            elif kind == MarkdownBlockSplitter.BLOCKS:
+                self._insert_markdown_fragment(cursor, segment_text)
+            else:
+                # Qt renders the closed fence with a trailing empty line.
+                self._insert_code_lines(cursor, "\n")
+            self.committed_length = segment_end
+            self._begin_open_block(cursor)
+
+        open_text = self.markdown_content[self.committed_length:]
+        if self.block_splitter.in_code_lines():
+            self._insert_code_lines(cursor, open_text)
+        else:
+            self._insert_markdown_fragment(cursor, open_text)
+
+    def _begin_open_block(self, cursor):
+        """make sure the open block is rendered in its own empty block."""
+        # Qt keeps the empty block after a table, like setMarkdown does.
+        previous_block = cursor.block().previous()
+        if cursor.block().length() > 1 or (previous_block.isValid() and
+                                           QTextCursor(previous_block).currentTable() is not None):
+            cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        else:
+            cursor.setBlockFormat(QTextBlockFormat())
+            cursor.setBlockCharFormat(QTextCharFormat())
+        self.committed_position = cursor.position()
+
+    def _insert_markdown_fragment(self, cursor, markdown_text):
+        if not markdown_text.strip():
+            return
+
+        fragment_document = QTextDocument()
+        fragment_document.setMarkdown(markdown_text)
+
+        # the first block of the fragment is merged into the current empty block.
+        first_block = fragment_document.firstBlock()
+        cursor.setBlockFormat(first_block.blockFormat())
+        cursor.setBlockCharFormat(first_block.charFormat())
+        start_position = cursor.position()
+        cursor.insertFragment(QTextDocumentFragment(fragment_document))
+
+        # a fragment starting with a list is inserted after the current block, remove the empty block left.
+        start_block = self.document().findBlock(start_position)
+        if first_block.textList() is not None and start_block.length() == 1:
+            QTextCursor(start_block).deleteChar()
+            start_block = self.document().findBlock(start_position)
+
+        # the table follows the previous paragraph, or the empty block after the previous table, directly.
+        # The empty block before it is merged into that block.
+        previous_block = start_block.previous()
+        if start_block.length() == 1 and QTextCursor(start_block.next()).currentTable() is not None \
+                and previous_block.isValid() and QTextCursor(previous_block).currentTable() is None \
+                and (previous_block.length() > 1 or QTextCursor(previous_block.previous()).currentTable() is not None):
+            QTextCursor(start_block).deletePreviousChar()
+            self.committed_position -= 1
+            return
+
+        # the ordered list items committed one by one are joined into one list, so that they are numbered in order.
+        # Joining costs a relayout of the whole list, the bullets are left as they are.
+        fragment_list = start_block.textList()
+        if fragment_list is None or fragment_list.format().style() not in self.ORDERED_LIST_STYLES:
+            return
+
+        # the paragraphs continuing the previous item are indented.
+        previous_block = start_block.previous()
+        while previous_block.isValid() and previous_block.textList() is None and previous_block.blockFormat().indent() > 0:
+            previous_block = previous_block.previous()
+        previous_list = previous_block.textList() if previous_block.isValid() else None
+        if previous_list is None or fragment_list == previous_list:
+            return
+        if (previous_list.format().style() != fragment_list.format().style() or
+                previous_list.format().indent() != fragment_list.format().indent()):
+            return
+
+        block = start_block
+        while block.isValid() and block.position() <= cursor.position():
+            if block.textList() == fragment_list:
+                previous_list.add(block)
+            block = block.next()
+
+    def _insert_code_lines(self, cursor, text):
+        """append the plain lines to the code block rendered before, instead of rendering the whole fence again."""
+        if not text:
+            return
+
+        code_block = cursor.block().previous()
+        format_cursor = QTextCursor(code_block)
+        format_cursor.movePosition(QTextCursor.EndOfBlock)
+        block_format = code_block.blockFormat()
+        char_format = format_cursor.charFormat()
+
+        # the committed lines end with a new line, the open line does not.
+        lines = text.split('\n')
+        for index, line in enumerate(lines):
+            if index > 0:
+                cursor.insertBlock(block_format, char_format)
+            else:
+                cursor.setBlockFormat(block_format)
+                cursor.setBlockCharFormat(char_format)
+            cursor.insertText(line, char_format)
+
+    def _reset_incremental_state(self):
+        """treat the whole rendered document as committed."""
+        self.committed_length = len(self.markdown_content)
+        self.committed_position = self.document().characterCount() - 1
+        self.block_splitter.reset(self.committed_length)
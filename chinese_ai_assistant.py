@@ -36,6 +36,8 @@ from .resources_rc import *
 
 # Import the code for the DockWidget
 from .chinese_ai_assistant_dockwidget import ChineseAIAssistantDockWidget
+from .network_client import NetworkClient
+from .image_cache import ImageCache
 
 class ChineseAIAssistant:
     """QGIS Plugin Implementation."""
@@ -214,6 +216,15 @@ class ChineseAIAssistant:
         # remove the toolbar
         del self.toolbar
 
+        # close the history database and stop tracking workspace.
+        if self.dockwidget:
+            self.dockwidget.history_manager.close()
+            self.dockwidget.workspace_context.unload()
+
+        # close the shared connections and drop the decoded images.
+        NetworkClient.release()
+        ImageCache.release()
+
     #--------------------------------------------------------------------------
 
     def run(self):
@@ -22,22 +22,23 @@
 """
 import json
 import os
-import time
 import requests
 import uuid
 
 from qgis.PyQt import uic
-from qgis.PyQt.QtWidgets import QDockWidget, QGridLayout, QDialog, QMessageBox
-from qgis.PyQt.QtCore import pyqtSignal
-from qgis.core import QgsSettings, QgsProject, Qgis, QgsMapLayer
+from qgis.PyQt.QtWidgets import QDockWidget, QGridLayout, QDialog, QMessageBox, QTabWidget, QToolButton, QLabel
+from qgis.PyQt.QtCore import Qt, pyqtSignal, QTimer
+from qgis.core import QgsSettings, QgsMessageLog, Qgis
 
-from .stream_chat_worker import StreamChatWorker
-from .chatbot_browser import ChatbotBrowser
+from .chat_session import ChatSession, ChatScheduler
 from .setting_dialog import SettingDialog
 from .global_defs import *
 from .resources_rc import *
 from .history_manager import HistoryManager
 from .history_dialog import HistoryDialog
+from .answer_cache import AnswerCache
+from .workspace_context import WorkspaceContext
+from .network_client import NetworkClient
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'chinese_ai_assistant_dockwidget_base.ui'))
@@ -50,49 +51,95 @@ class ChineseAIAssistantDockWidget(QDockWidget, FORM_CLASS):
         """Constructor."""
         super(ChineseAIAssistantDockWidget, self).__init__(parent)
         self.iface = iface
-        self.chat_worker = None
         self.setupUi(self)
 
-        self.chatbot_browser = ChatbotBrowser(iface)
         self.history_manager = HistoryManager()
+        self.answer_cache = AnswerCache(self.history_manager)
+        self.workspace_context = WorkspaceContext(iface, self)
+
+        # every conversation lives in its own tab, the scheduler limits the concurrent requests.
+        self.sessions = []
+        self.scheduler = ChatScheduler(int(QgsSettings().value(MAX_CONCURRENT_CHATS_TAG, "2")), self)
+
+        self.tabWidgetChat = QTabWidget()
+        self.tabWidgetChat.setTabsClosable(True)
+        self.tabWidgetChat.setMovable(True)
+        self.tabWidgetChat.setDocumentMode(True)
+        self.btnNewChat = QToolButton()
+        self.btnNewChat.setText("+")
+        self.btnNewChat.setToolTip(self.tr("New Chat"))
+        self.btnNewChat.setAutoRaise(True)
+        self.tabWidgetChat.setCornerWidget(self.btnNewChat, Qt.TopRightCorner)
 
         chatbot_layout = QGridLayout()
         chatbot_layout.setContentsMargins(0, 0, 0, 0)
-        chatbot_layout.addWidget(self.chatbot_browser)
+        chatbot_layout.addWidget(self.tabWidgetChat, 0, 0)
         self.widgetChatbotParent.setLayout(chatbot_layout)
 
+        # the timing of current chat is shown over the chatbot for diagnostics.
+        self.labelTiming = QLabel()
+        self.labelTiming.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.labelTiming.setStyleSheet(
+            "background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; font-size: 8pt; padding: 4px;")
+        self.labelTiming.hide()
+        chatbot_layout.addWidget(self.labelTiming, 0, 0, Qt.AlignRight | Qt.AlignBottom)
+        self.timing_timer = QTimer(self)
+        self.timing_timer.timeout.connect(self._update_timing_overlay)
+
         self.btnSendOrTerminate.clicked.connect(self.handle_click_send_or_terminate_btn)
         self.btnClear.clicked.connect(self.handle_click_clear_btn)
         self.btnSetting.clicked.connect(self.handle_click_setting_btn)
-        self.chatbot_browser.show_setting_dlg.connect(self.handle_click_setting_btn)
-        self.chatbot_browser.trigger_feedback.connect(self.handle_click_feedback)
-        self.chatbot_browser.trigger_repeat.connect(self.handle_click_repeat)
         self.btnHistory.clicked.connect(self.handle_click_history_btn)
+        self.btnNewChat.clicked.connect(self.handle_click_new_chat_btn)
+        self.tabWidgetChat.currentChanged.connect(self._update_buttons)
+        self.tabWidgetChat.tabCloseRequested.connect(self.handle_close_tab)
 
-        # use custom function to deal with "Open Links".
-        self.chatbot_browser.setOpenLinks(False)
-
-        # 0: Send 1: Terminate
-        self.btn_send_or_terminate_tag = 0
+        self._new_session()
+        self._apply_timing_setting()
 
-        self.chat_id = None
-        self.pre_chat_timestamp = 0
+    def showEvent(self, event):
+        # connect to server in advance when the dock opens.
+        NetworkClient.instance().prewarm()
+        super().showEvent(event)
 
     def closeEvent(self, event):
         self.closingPlugin.emit()
         event.accept()
 
     def handle_click_send_or_terminate_btn(self):
-        if self.btn_send_or_terminate_tag == 0:
-            self._begin_chat()
-        elif self.btn_send_or_terminate_tag == 1:
-            self._stop_chat()
+        session = self._current_session()
+        if session.is_busy():
+            self._stop_chat(session)
+        else:
+            self._begin_chat(session, self.plainTextEdit.toPlainText())
 
     def handle_click_clear_btn(self):
-        self.chatbot_browser.clear()
+        self._current_session().reset()
         self.plainTextEdit.clear()
-        self.chat_id = None
-        self.pre_chat_timestamp = 0
+
+    def handle_click_new_chat_btn(self):
+        self._new_session()
+        self.plainTextEdit.clear()
+        self.plainTextEdit.setFocus()
+
+    def handle_close_tab(self, index):
+        session = self._session_of_tab(index)
+        if session is None:
+            return
+
+        if session.is_busy():
+            self._stop_chat(session)
+        self.scheduler.remove(session)
+
+        self.sessions.remove(session)
+        self.tabWidgetChat.removeTab(index)
+        session.browser.unload()
+        session.browser.deleteLater()
+        session.deleteLater()
+
+        # there is always one tab to chat in.
+        if not self.sessions:
+            self._new_session()
 
     def handle_click_setting_btn(self):
         dlg = SettingDialog(self.iface, parent=self)
@@ -100,6 +147,10 @@ class ChineseAIAssistantDockWidget(QDockWidget, FORM_CLASS):
         dlg.show()
         dlg.exec()
 
+        # the running sessions are not affected, the queued ones start earlier if allowed.
+        self.scheduler.set_max_in_flight(int(QgsSettings().value(MAX_CONCURRENT_CHATS_TAG, "2")))
+        self._apply_timing_setting()
+
     def handle_click_history_btn(self):
         dlg = HistoryDialog(self.history_manager)
         dlg.setModal(True)
@@ -113,23 +164,24 @@ class ChineseAIAssistantDockWidget(QDockWidget, FORM_CLASS):
         if history_item is None:
             return
 
-        self.chatbot_browser.clear()
+        # never replace the answer being streamed.
+        session = self._current_session()
+        if session.is_busy():
+            session = self._new_session()
+
         self.plainTextEdit.clear()
-        self.chat_id = None
-        self.pre_chat_timestamp = history_item.get("timestamp", 0)
-        self.chatbot_browser.pre_process_markdown()
-        self.chatbot_browser.append_markdown(history_item["answer"], scroll_to_bottom=False)
-        self.chatbot_browser.post_process_markdown(show_feedback=False)
+        session.show_history(history_item)
 
     def handle_click_feedback(self, star: int):
-        if not self.chat_id:
+        chat_id = self._current_session().chat_id
+        if not chat_id:
             return
 
         try:
             # send feedback to server
-            response = requests.post (
-                AI_SERVER_DOMAIN + "/ai/v1/feedback",
-                json={"chat_id": self.chat_id, "star": star},
+            response = NetworkClient.instance().post_json(
+                "/ai/v1/feedback",
+                {"chat_id": chat_id, "star": star},
                 timeout=2
             )
 
@@ -149,67 +201,122 @@ class ChineseAIAssistantDockWidget(QDockWidget, FORM_CLASS):
                                  QMessageBox.Ok)
 
     def handle_click_repeat(self):
-        # remove the lasted history.
-        histories = self.history_manager.enum_question()
-        if not histories:
+        session = self._current_session()
+        if session.is_busy() or not session.question:
             return
 
-        # remove the lasted chat.
-        self.pre_chat_timestamp = histories[0].get("pre_timestamp", 0)
-        self.history_manager.remove_history(histories[0].get("timestamp"))
+        # remove the lasted chat of this session if it answers the question, the server state contains it.
+        # The stopped question has no history, the lasted chat is the previous turn then.
+        last_history = self.history_manager.retrieve_history(session.last_chat_timestamp) \
+            if session.last_chat_timestamp else None
+        if last_history is not None and last_history["question"] == session.question:
+            self.history_manager.remove_history(session.last_chat_timestamp)
+            session.pre_chat_timestamp = session.last_pre_chat_timestamp
+        session.conversation_state.reset()
 
         # repeat chat.
-        self._begin_chat()
-
-    def on_chunks_info_received(self, content):
-        """receive the count of references"""
-        pass
-
-    def on_content_received(self, content):
-        """receive the streaming message."""
-        # append every message to the chatbot browser.
-        self.chatbot_browser.append_markdown(content)
-
-    def on_stream_ended(self, chunk_count):
-        self.chatbot_browser.post_process_markdown()
-        self.btn_send_or_terminate_tag = 0
-        self.btnSendOrTerminate.setText(self.tr("Send"))
-        self.btnSendOrTerminate.setEnabled(True)
-        self.btnHistory.setEnabled(True)
-        self.btnClear.setEnabled(True)
-
-        # save to history
-        cur_chat_timestamp = int(time.time())
-        self.history_manager.put_history(
-            cur_chat_timestamp,
-            self.pre_chat_timestamp,
-            self.plainTextEdit.toPlainText(),
-            self.chatbot_browser.get_raw_markdown_content())
-
-        # current chat will be the next previous chat.
-        self.pre_chat_timestamp = cur_chat_timestamp
-
-    def on_error_occurred(self, error_msg):
-        """deal with errors"""
-        # show errors in chatbot.
-        self.chatbot_browser.append_markdown(error_msg)
-
-        # resume button status.
-        self.btn_send_or_terminate_tag = 0
-        self.btnSendOrTerminate.setText(self.tr("Send"))
-        self.btnSendOrTerminate.setEnabled(True)
-        self.btnHistory.setEnabled(True)
-        self.btnClear.setEnabled(True)
-
-    def _begin_chat(self):
-        # In order to  make the markdown render faster, we have to clear the previous markdown content.
-        self.chatbot_browser.clear()
+        self._begin_chat(session, session.question, use_answer_cache=False)
+
+    def handle_click_refresh(self):
+        session = self._current_session()
+        if session.is_busy():
+            return
+
+        # ask the server again instead of replaying the cached answer.
+        session.pre_chat_timestamp = 0
+        session.conversation_state.reset()
+        self._begin_chat(session, session.question, use_answer_cache=False)
+
+    def on_retrying(self, attempt, delay):
+        """the connection is lost, the worker will resume the answer."""
+        QgsMessageLog.logMessage(
+            self.tr("Connection lost, retry {0} in {1} ms").format(attempt, delay),
+            "Chinese AI Assistant", Qgis.Warning)
+
+    def on_session_finished(self, session):
+        """keep the timing of the finished chat for offline analysis."""
+        if QgsSettings().value(TIMING_LOG_TAG, "false") == "true":
+            session.timing.append_to_log()
+
+    def on_session_state_changed(self, session):
+        """show the question and state of session in its tab."""
+        index = self.tabWidgetChat.indexOf(session.browser)
+        if index < 0:
+            return
+
+        title = session.title() or self.tr("New Chat")
+        if session.state == ChatSession.QUEUED:
+            title = self.tr("[Queued {0}] ").format(self.scheduler.queue_position(session)) + title
+        elif session.state == ChatSession.RUNNING:
+            title = "● " + title
+        self.tabWidgetChat.setTabText(index, title)
+        self.tabWidgetChat.setTabToolTip(index, session.question)
+
+        if index == self.tabWidgetChat.currentIndex():
+            self._update_buttons()
+
+    def _new_session(self):
+        session = ChatSession(self.iface, self.history_manager, self.answer_cache, self)
+        session.browser.show_setting_dlg.connect(self.handle_click_setting_btn)
+        session.browser.trigger_feedback.connect(self.handle_click_feedback)
+        session.browser.trigger_repeat.connect(self.handle_click_repeat)
+        session.browser.trigger_refresh.connect(self.handle_click_refresh)
+        session.retrying.connect(self.on_retrying)
+        session.finished.connect(self.scheduler.on_session_finished)
+        session.finished.connect(self.on_session_finished)
+        session.state_changed.connect(self._update_tabs)
+
+        self.sessions.append(session)
+        index = self.tabWidgetChat.addTab(session.browser, self.tr("New Chat"))
+        self.tabWidgetChat.setCurrentIndex(index)
+        return session
+
+    def _current_session(self):
+        return self._session_of_tab(self.tabWidgetChat.currentIndex())
+
+    def _session_of_tab(self, index):
+        browser = self.tabWidgetChat.widget(index)
+        for session in self.sessions:
+            if session.browser is browser:
+                return session
+        return None
+
+    def _update_tabs(self):
+        # the positions of all queued sessions may change.
+        for session in self.sessions:
+            self.on_session_state_changed(session)
+
+    def _update_buttons(self):
+        session = self._current_session()
+        if session is None:
+            return
+
+        busy = session.is_busy()
+        self.btnSendOrTerminate.setText(self.tr("Stop") if busy else self.tr("Send"))
+        self.btnHistory.setEnabled(not busy)
+        self.btnClear.setEnabled(not busy)
+
+    def _apply_timing_setting(self):
+        if QgsSettings().value(TIMING_OVERLAY_TAG, "false") == "true":
+            self._update_timing_overlay()
+            self.labelTiming.show()
+            self.timing_timer.start(500)
+        else:
+            self.timing_timer.stop()
+            self.labelTiming.hide()
+
+    def _update_timing_overlay(self):
+        session = self._current_session()
+        if session is not None:
+            self.labelTiming.setText(session.timing.summary())
+
+    def _begin_chat(self, session, question_str, use_answer_cache=True):
+        # build new chat id, the rendering of question is timed with the new chat.
+        session.chat_id = uuid.uuid4().hex
+        session.start_timing()
 
         # add question in chatbot
-        question_str = self.plainTextEdit.toPlainText()
-        self.chatbot_browser.pre_process_markdown()
-        self.chatbot_browser.append_markdown(self.tr("**Question:") + question_str + "**\n\n")
-        self.chatbot_browser.append_markdown(self.tr("**Answer:") + "**\n\n")
+        session.show_question(question_str)
 
         gSetting = QgsSettings()
 
@@ -219,25 +326,41 @@ class ChineseAIAssistantDockWidget(QDockWidget, FORM_CLASS):
         # email
         user_email = gSetting.value(USER_EMAIL_TAG, "")
 
-        # build new chat id.
-        self.chat_id = uuid.uuid4().hex
-
-        # get qgis basic information in project context.
-        workspace_info = self._get_workspace_info()
+        # the cadence of rendering streamed content.
+        session.browser.render_interval = int(gSetting.value(RENDER_INTERVAL_TAG, "50"))
+
+        # only the answer of question without context could be cached.
+        session.answer_cache_key = None
+        if session.pre_chat_timestamp == 0 and gSetting.value(ANSWER_CACHE_TAG, "false") == "true":
+            self.answer_cache.ttl = int(gSetting.value(ANSWER_CACHE_TTL_TAG, "168")) * 3600
+            self.answer_cache.max_size = int(gSetting.value(ANSWER_CACHE_SIZE_TAG, "200"))
+            with session.timing.span("workspace_snapshot"):
+                workspace_fingerprint = AnswerCache.workspace_fingerprint(self.workspace_context.snapshot())
+            session.answer_cache_key = (question_str, workspace_fingerprint)
+
+            if use_answer_cache:
+                cached_history = self.answer_cache.lookup(*session.answer_cache_key)
+                if cached_history:
+                    session.timing.mark("replayed")
+                    session.replay_answer(cached_history, self.tr(
+                        "*This answer is replayed from the local cache.* [Refresh](agent://refresh)"))
+                    return
+
+        # get qgis basic information in project context, the most relevant layers first.
+        workspace_budget = int(gSetting.value(WORKSPACE_BUDGET_TAG, "16")) * 1024
+        with session.timing.span("workspace"):
+            workspace_info, workspace_size = self.workspace_context.build_payload(question_str, workspace_budget)
+        session.timing.count("workspace_bytes", workspace_size)
+        QgsMessageLog.logMessage(
+            self.tr("Workspace context: {0} layers, {1} bytes").format(len(workspace_info["Layers"]), workspace_size),
+            "Chinese AI Assistant", Qgis.Info)
 
         histories = []
-        if self.pre_chat_timestamp > 0:
+        if session.pre_chat_timestamp > 0:
             # retrieve previous messages from the conversation history
             multi_turn = int(gSetting.value(MULTI_TURN_TAG, "2"))
-            parent_chat_ts = self.pre_chat_timestamp
-            while multi_turn > 0 and parent_chat_ts > 0:
-                pre_history = self.history_manager.retrieve_history(parent_chat_ts)
-                if not pre_history:
-                    break
-
-                histories.append(pre_history)
-                parent_chat_ts = pre_history.get("pre_timestamp", 0)
-                multi_turn -= 1
+            with session.timing.span("history_chain"):
+                histories = self.history_manager.retrieve_history_chain(session.pre_chat_timestamp, multi_turn)
 
         # prepare request body.
         request_data = {
@@ -249,140 +372,29 @@ class ChineseAIAssistantDockWidget(QDockWidget, FORM_CLASS):
             "email": user_email,
             "version": VERSION,
             "user_id": user_id,
-            "chat_id": self.chat_id,
+            "chat_id": session.chat_id,
             "lang": 'zh',
             "workspace": workspace_info
         }
 
-        self.chat_worker = StreamChatWorker(request_data)
-        self.chat_worker.chunks_info_received.connect(self.on_chunks_info_received)
-        self.chat_worker.content_received.connect(self.on_content_received)
-        self.chat_worker.stream_ended.connect(self.on_stream_ended)
-        self.chat_worker.error_occurred.connect(self.on_error_occurred)
-        self.chat_worker.start()
-
-        self.btn_send_or_terminate_tag = 1
-        self.btnSendOrTerminate.setText(self.tr("Stop"))
-        self.btnHistory.setEnabled(False)
-        self.btnClear.setEnabled(False)
-
-    def _stop_chat(self):
-        if self.chat_worker:
-            self.btnSendOrTerminate.setEnabled(False)
-            self.chat_worker.exit()
-            self.chat_worker.wait(3000)
-
-        self.chatbot_browser.post_process_markdown()
-        self.btnSendOrTerminate.setEnabled(True)
-        self.btn_send_or_terminate_tag = 0
-        self.btnSendOrTerminate.setText(self.tr("Send"))
-        self.btnHistory.setEnabled(True)
-        self.btnClear.setEnabled(True)
-
-    def _get_workspace_info(self):
-        workspace_info = {}
-
-        # qgis version
-        workspace_info["version"] = Qgis.version()
-
-        # get working project
-        project = QgsProject.instance()
-
-        # CRS part
-        project_crs = project.crs()
-        workspace_info["CRSAuthId"] = project_crs.authid()
-
-        # get map canvas parameters.
-        map_canvas = self.iface.mapCanvas()
-        canvas_extent = map_canvas.extent()
-        workspace_info["MapCanvasExtent"] = [
-            f"{canvas_extent.xMinimum():.6f}",
-            f"{canvas_extent.yMinimum():.6f}",
-            f"{canvas_extent.xMaximum():.6f}",
-            f"{canvas_extent.yMaximum():.6f}"]
-
-        # enumerate layers in project.
-        layers_info = []
-        layer_tree_root = project.layerTreeRoot()
-        layers = project.mapLayers().values()
-        for layer in layers:
-            node = layer_tree_root.findLayer(layer.id())
-            visible = node.isVisible() if node else False
-
-            layer_info = {}
-            layer_info["name"] = f"{layer.name()}"
-            layer_info["type"] = f"{layer.type().name}"
-            layer_info["visible"] = visible
-
-            crs = layer.crs()
-            layer_info["CRSAuthId"] = f"{crs.authid()}"
-
-            # get fields data in vector data.
-            if layer.type() == QgsMapLayer.VectorLayer:
-                fields_info = []
-                fields = layer.fields()
-                for field in fields:
-                    field_info = {
-                        "name": field.name(),
-                        "type": field.typeName(),
-                        "length": field.length(),
-                        "precision": field.precision()
-                    }
-                    fields_info.append(field_info)
-                layer_info["fields"] = fields_info
-
-            # get bands data in raster data.
-            elif layer.type() == QgsMapLayer.RasterLayer:
-                bands_info = []
-                provider = layer.dataProvider()
-                if provider:
-                    # basic raster variables.
-                    layer_info["raster_width"] = provider.xSize()
-                    layer_info["raster_height"] = provider.ySize()
-
-                    # extent of data.
-                    extent = provider.extent()
-                    layer_info["raster_extent"] = [
-                        f"{extent.xMinimum():.6f}",
-                        f"{extent.yMinimum():.6f}",
-                        f"{extent.xMaximum():.6f}",
-                        f"{extent.yMaximum():.6f}"
-                    ]
-
-                    if provider.xSize() > 0 and provider.ySize() > 0:
-                        pixel_size_x = (extent.xMaximum() - extent.xMinimum()) / provider.xSize()
-                        pixel_size_y = (extent.yMaximum() - extent.yMinimum()) / provider.ySize()
-                        layer_info["pixel_size"] = [
-                            f"{pixel_size_x:.6f}",
-                            f"{pixel_size_y:.6f}"
-                        ]
-
-                    layer_info["origin"] = [
-                        f"{extent.xMinimum():.6f}",
-                        f"{extent.yMaximum():.6f}"
-                    ]
-
-                    band_count = provider.bandCount()
-                    for band in range(1, band_count + 1):
-                        band_info = {
-                            "band_number": band,
-                            "band_name": f"Band {band}",
-                            "data_type": provider.dataType(band),
-                            "color_interpretation": provider.colorInterpretation(band).name
-                        }
-
-                        # In order to shorten time of statistic, use the custom sample size.
-                        customSampleSize = int(max(provider.xSize(), provider.ySize()) / 256)
-                        stats = provider.bandStatistics(band, sampleSize=customSampleSize)
-                        if stats:
-                            band_info["minimum"] = stats.minimumValue
-                            band_info["maximum"] = stats.maximumValue
-                            band_info["mean"] = stats.mean
-                            band_info["std_dev"] = stats.stdDev
-                        bands_info.append(band_info)
-                layer_info["bands"] = bands_info
-
-            layers_info.append(layer_info)
-        workspace_info["Layers"] = layers_info
-
-        return workspace_info
\ No newline at end of file
+        # retry policy of the interrupted stream.
+        max_retries = int(gSetting.value(RETRY_COUNT_TAG, "3"))
+        retry_delay = int(gSetting.value(RETRY_DELAY_TAG, "500"))
+
+        # send the new turn and the workspace changes only, if the server keeps the conversation.
+        fallback_request_data = None
+        if gSetting.value(CONVERSATION_STATE_TAG, "false") == "true":
+            with session.timing.span("prepare_request"):
+                request_data, fallback_request_data = session.conversation_state.prepare(request_data)
+        # the server does not tell whether it accepts gzip bodies, so it is turned on by the user.
+        compress = gSetting.value(COMPRESS_REQUEST_TAG, "false") == "true"
+
+        # the request waits in queue if too many answers are streaming.
+        session.set_request(request_data, max_retries, retry_delay, compress, fallback_request_data)
+        session.timing.mark("submitted")
+        self.scheduler.submit(session)
+
+    def _stop_chat(self, session):
+        # the queued request is never sent, the running one is aborted immediately.
+        self.scheduler.cancel(session)
+        session.stop()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                               Conversation State
+  Send only the new turn of a conversation whose state is kept by the server.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import uuid
+
+
+class ConversationState:
+    """
+    Track the workspace snapshot acknowledged by the server for one conversation.
+
+    The first turn sends the history and the whole workspace with a conversation id.
+    Once a turn is answered completely, the server keeps them, and the next turn
+    sends the question and the changes of workspace against the acknowledged revision.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """start a new conversation, the server state of the previous one is never used again."""
+        self.conversation_id = uuid.uuid4().hex
+        self.acked_workspace = None
+        self.acked_revision = 0
+        self.pending_workspace = None
+        self.pending_revision = 0
+
+    def is_established(self):
+        return self.acked_workspace is not None
+
+    def prepare(self, request_data: dict):
+        """
+        Return the request to send, and the full request to send instead if the
+        server has lost the conversation state, which is None for the full request.
+        """
+        workspace_info = request_data["workspace"]
+        self.pending_workspace = workspace_info
+        self.pending_revision = self.acked_revision + 1
+
+        full_request_data = dict(request_data)
+        full_request_data["conversation_id"] = self.conversation_id
+        full_request_data["workspace_revision"] = self.pending_revision
+        if not self.is_established():
+            return full_request_data, None
+
+        delta_request_data = {key: value for key, value in full_request_data.items()
+                              if key not in ("history", "workspace")}
+        delta_request_data["workspace_base"] = self.acked_revision
+        delta_request_data["workspace_delta"] = self.workspace_delta(self.acked_workspace, workspace_info)
+        return delta_request_data, full_request_data
+
+    def acknowledge(self):
+        """the turn is answered, so the server has the workspace of it."""
+        if self.pending_workspace is None:
+            return
+
+        self.acked_workspace = self.pending_workspace
+        self.acked_revision = self.pending_revision
+        self.pending_workspace = None
+
+    @staticmethod
+    def workspace_delta(base: dict, current: dict):
+        """the top level values and layers changed from base to current."""
+        delta = {
+            "set": {key: value for key, value in current.items()
+                    if key != "Layers" and base.get(key) != value},
+            "unset": [key for key in base if key != "Layers" and key not in current]
+        }
+
+        base_layers = ConversationState._layers_by_key(base.get("Layers", []))
+        current_layers = ConversationState._layers_by_key(current.get("Layers", []))
+        delta["layers_set"] = {key: layer_info for key, layer_info in current_layers.items()
+                               if base_layers.get(key) != layer_info}
+        delta["layers_removed"] = [key for key in base_layers if key not in current_layers]
+        return delta
+
+    @staticmethod
+    def _layers_by_key(layers_info):
+        """key the layers by name, the layers of the same name are numbered in order."""
+        layers = {}
+        for layer_info in layers_info:
+            key = layer_info.get("name", "")
+            number = 2
+            while key in layers:
+                key = f"{layer_info.get('name', '')}#{number}"
+                number += 1
+            layers[key] = layer_info
+        return layers
@@ -20,10 +20,25 @@
  ***************************************************************************/
 """
 
+import os
+
 VERSION = "0.4"
 
-AI_SERVER_DOMAIN = "https://www.phoenix-gis.cn"
+# the server could be replaced by a local one, e.g. benchmarks/mock_server.py.
+AI_SERVER_DOMAIN = os.environ.get("CHINESE_AI_ASSISTANT_SERVER", "https://www.phoenix-gis.cn").rstrip("/")
 
 USER_ID_TAG = "chinese-ai-assistant/uid"
 USER_EMAIL_TAG = "chinese-ai-assistant/email"
-MULTI_TURN_TAG = "chinese-ai-assistant/multi_turn"
\ No newline at end of file
+MULTI_TURN_TAG = "chinese-ai-assistant/multi_turn"
+RENDER_INTERVAL_TAG = "chinese-ai-assistant/render_interval"
+ANSWER_CACHE_TAG = "chinese-ai-assistant/answer_cache"
+ANSWER_CACHE_TTL_TAG = "chinese-ai-assistant/answer_cache_ttl"
+ANSWER_CACHE_SIZE_TAG = "chinese-ai-assistant/answer_cache_size"
+WORKSPACE_BUDGET_TAG = "chinese-ai-assistant/workspace_budget"
+RETRY_COUNT_TAG = "chinese-ai-assistant/retry_count"
+RETRY_DELAY_TAG = "chinese-ai-assistant/retry_delay"
+MAX_CONCURRENT_CHATS_TAG = "chinese-ai-assistant/max_concurrent_chats"
+COMPRESS_REQUEST_TAG = "chinese-ai-assistant/compress_request"
+CONVERSATION_STATE_TAG = "chinese-ai-assistant/conversation_state"
+TIMING_OVERLAY_TAG = "chinese-ai-assistant/timing_overlay"
+TIMING_LOG_TAG = "chinese-ai-assistant/timing_log"
\ No newline at end of file
@@ -23,8 +23,10 @@
 import os
 
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import Qt
-from qgis.PyQt.QtWidgets import QDialog, QListWidgetItem, QMessageBox
+from qgis.PyQt.QtCore import Qt, QTimer
+from qgis.PyQt.QtWidgets import QDialog, QMessageBox
+
+from .history_list_model import HistoryListModel
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'history_dialog.ui'))
@@ -42,21 +44,25 @@ class HistoryDialog(QDialog, FORM_CLASS):
         self.btnOpen.clicked.connect(self.handle_open_clicked)
         self.btnCancel.clicked.connect(self.handle_cancel_clicked)
         self.clearBtn.clicked.connect(self.handle_clear_clicked)
-        self.listWidget.itemDoubleClicked.connect(self.handle_list_item_dclicked)
+        self.listView.doubleClicked.connect(self.handle_list_item_dclicked)
+
+        # questions are loaded page by page when scrolling.
+        self.list_model = HistoryListModel(self.manager, self)
+        self.listView.setModel(self.list_model)
 
-        for question_item in self.manager.enum_question():
-            list_item = QListWidgetItem()
-            list_item.setText(question_item["question"])
-            list_item.setData(Qt.UserRole, question_item["timestamp"])
-            self.listWidget.addItem(list_item)
+        # search after the user stops typing.
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.handle_search)
+        self.lineEditSearch.textChanged.connect(lambda: self.search_timer.start(200))
 
     def get_selected_history_timestamp(self):
         return self.selected_timestamp
 
     def handle_open_clicked(self):
-        selected_items = self.listWidget.selectedItems()
-        if len(selected_items) > 0:
-            self.selected_timestamp = selected_items[0].data(Qt.UserRole)
+        selected_indexes = self.listView.selectionModel().selectedIndexes()
+        if len(selected_indexes) > 0:
+            self.selected_timestamp = selected_indexes[0].data(Qt.UserRole)
 
         super().accept()
 
@@ -70,11 +76,14 @@ class HistoryDialog(QDialog, FORM_CLASS):
             return
 
         self.manager.clear_history()
-        self.listWidget.clear()
+        self.list_model.clear()
+
+    def handle_search(self):
+        self.list_model.set_keyword(self.lineEditSearch.text().strip())
 
-    def handle_list_item_dclicked(self, list_item):
-        if list_item is None:
+    def handle_list_item_dclicked(self, index):
+        if not index.isValid():
             return
 
-        self.selected_timestamp = list_item.data(Qt.UserRole)
+        self.selected_timestamp = index.data(Qt.UserRole)
         super().accept()
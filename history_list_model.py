@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                               History List Model
+  A list model that loads the questions of chat history page by page.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import Qt, QAbstractListModel, QModelIndex
+
+
+class HistoryListModel(QAbstractListModel):
+
+    PAGE_SIZE = 200
+
+    def __init__(self, history_manager, parent=None):
+        super().__init__(parent)
+        self.manager = history_manager
+        self.keyword = ""
+        self.items = []
+        self.all_fetched = False
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.items):
+            return None
+
+        item = self.items[index.row()]
+        if role == Qt.DisplayRole:
+            # show the first line of question only.
+            return item["question"].strip().split("\n", 1)[0]
+        elif role == Qt.ToolTipRole:
+            return item.get("snippet") or item["question"]
+        elif role == Qt.UserRole:
+            return item["timestamp"]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return not self.all_fetched
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.all_fetched:
+            return
+
+        if self.keyword:
+            page = self.manager.search_history(self.keyword, self.PAGE_SIZE, len(self.items))
+        else:
+            page = self.manager.enum_question_page(len(self.items), self.PAGE_SIZE)
+        if len(page) < self.PAGE_SIZE:
+            self.all_fetched = True
+        if not page:
+            return
+
+        self.beginInsertRows(QModelIndex(), len(self.items), len(self.items) + len(page) - 1)
+        self.items.extend(page)
+        self.endInsertRows()
+
+    def set_keyword(self, keyword: str):
+        """search questions and answers by keyword and fetch them again."""
+        self.beginResetModel()
+        self.keyword = keyword
+        self.items = []
+        self.all_fetched = False
+        self.endResetModel()
+
+    def clear(self):
+        self.beginResetModel()
+        self.items = []
+        self.all_fetched = True
+        self.endResetModel()
@@ -21,79 +21,446 @@
 """
 
 import json
+import operator
 import os
-from PyQt5.QtCore import QStandardPaths
+import queue
+import re
+import sqlite3
+from threading import Lock
+from PyQt5.QtCore import QStandardPaths, QThread, Qt, pyqtSignal
+from qgis.core import QgsMessageLog, Qgis
+from .answer_cache import AnswerCache
+
+HISTORY_COLUMNS = "timestamp, pre_timestamp, question, answer"
+# the answers are read from the database when they are needed, only the other columns are cached.
+CACHED_COLUMNS = "id, timestamp, pre_timestamp, question"
+
+# the CJK ideographs, whose runs are indexed by bigrams.
+CJK_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+CJK_RUN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]{2,}')
+
+class HistoryWriteWorker(QThread):
+    """write histories into the database in background, in the order they are queued."""
+
+    # a batch of writes is lost, the cached histories no longer match the database.
+    write_failed = pyqtSignal()
+
+    def __init__(self, connection, connection_lock):
+        super().__init__()
+        self.connection = connection
+        self.connection_lock = connection_lock
+        self.write_queue = queue.Queue()
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            operations = [self.write_queue.get()]
+
+            # batch all pending writes into one transaction.
+            while True:
+                try:
+                    operations.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # None is the stop flag.
+            stopping = None in operations
+            statements = [operation for operation in operations if operation is not None]
+
+            try:
+                with self.connection_lock, self.connection:
+                    for sql, parameters in statements:
+                        self.connection.execute(sql, parameters)
+            except sqlite3.Error as e:
+                QgsMessageLog.logMessage(
+                    f"Failed to write {len(statements)} history operations: {e}",
+                    "Chinese AI Assistant", Qgis.Warning)
+                self.write_failed.emit()
+            finally:
+                for _ in operations:
+                    self.write_queue.task_done()
+
+    def enqueue(self, sql, parameters=()):
+        self.write_queue.put((sql, parameters))
+
+    def flush(self):
+        """block until all queued writes are committed."""
+        self.write_queue.join()
+
+    def stop(self):
+        """commit the queued writes and stop the thread."""
+        self.write_queue.put(None)
+        self.wait()
 
 class HistoryManager:
 
     def __init__(self):
         self.history_file = self.__get_history_file_path()
+        self.legacy_history_file = self.__get_legacy_history_file_path()
+        self.full_text_search = False
+        self.connection = self._open_database()
+
+        # the connection is shared with the background writer.
+        self.connection_lock = Lock()
+        self.writer = None
+        if self.connection is not None:
+            self.writer = HistoryWriteWorker(self.connection, self.connection_lock)
+            # invalidate before the failed batch is marked done, so that a flush() is followed by a reload.
+            self.writer.write_failed.connect(self._invalidate_cache, Qt.DirectConnection)
+            self.writer.start()
+
+        # write-through cache, sorted by timestamp and indexed by timestamp.
+        self.cached_histories = None
+        self.cached_index = {}
+        self.cached_data_version = None
     def put_history(self, timestamp: int, pre_timestamp:int, question: str, answer: str):
         """add new history"""
-        histories = self._load_histories()
+        if self.connection is None:
+            return
 
-        # add new item if the timestamp not found.
-        histories.append({
+        self._ensure_cache()
+        self.writer.enqueue(
+            f"INSERT INTO histories ({HISTORY_COLUMNS}) VALUES (?, ?, ?, ?)",
+            (timestamp, pre_timestamp, question, answer))
+        if self.full_text_search:
+            # queued right after the history, in the same transaction.
+            self.writer.enqueue(
+                "INSERT INTO histories_bigram (rowid, question, answer) VALUES (last_insert_rowid(), ?, ?)",
+                (self._cjk_bigrams(question), self._cjk_bigrams(answer)))
+
+        # insert after the items with the same or greater timestamp, the id is known once it is written.
+        item = {
+            'id': None,
             'timestamp': timestamp,
             'pre_timestamp': pre_timestamp,
-            'question': question,
-            'answer': answer
-        })
-
-        self._save_histories(histories)
+            'question': question
+        }
+        position = 0
+        while position < len(self.cached_histories) and self.cached_histories[position]['timestamp'] >= timestamp:
+            position += 1
+        self.cached_histories.insert(position, item)
+        self.cached_index.setdefault(timestamp, item)
 
     def remove_history(self, timestamp: int):
         """remove history by timestamp"""
-        histories = self._load_histories()
+        if self.connection is None:
+            return False
 
-        new_histories = [item for item in histories if item['timestamp'] != timestamp]
+        self._ensure_cache()
+        if timestamp not in self.cached_index:
+            return False
 
-        if len(new_histories) != len(histories):
-            self._save_histories(new_histories)
-            return True
-        return False
+        self.writer.enqueue("DELETE FROM histories WHERE timestamp = ?", (timestamp,))
+
+        del self.cached_index[timestamp]
+        self.cached_histories = [item for item in self.cached_histories if item['timestamp'] != timestamp]
+        return True
+    def has_history(self, timestamp):
+        """the history of the timestamp exists, without reading its answer."""
+        self._ensure_cache()
+        return timestamp in self.cached_index
     def retrieve_history(self, timestamp):
         """retrieve the history chat base on timestamp."""
-        histories = self._load_histories()
-        for item in histories:
-            if item['timestamp'] == timestamp:
-                return item
-        return None
+        self._ensure_cache()
+        item = self.cached_index.get(timestamp)
+        if item is None:
+            return None
+        return self._load_answer(item)
+    def retrieve_history_chain(self, timestamp, max_turns):
+        """retrieve the chat of timestamp and its previous chats, the latest first."""
+        self._ensure_cache()
+
+        histories = []
+        while max_turns > 0 and timestamp > 0:
+            item = self.cached_index.get(timestamp)
+            history_item = self._load_answer(item) if item is not None else None
+            if history_item is None:
+                break
+
+            histories.append(history_item)
+            timestamp = item['pre_timestamp']
+            max_turns -= 1
+        return histories
+    def enum_question_page(self, offset: int, limit: int):
+        """enumerate a page of questions sorted by timestamp, without loading the answers."""
+        if self.connection is None:
+            return []
+
+        # the queued writes should be listed too.
+        self.flush()
+
+        try:
+            with self.connection_lock:
+                rows = self.connection.execute(
+                    "SELECT timestamp, question FROM histories ORDER BY timestamp DESC, id LIMIT ? OFFSET ?",
+                    (limit, offset)).fetchall()
+        except sqlite3.Error:
+            return []
+        return [dict(row) for row in rows]
+    def search_history(self, keyword: str, limit: int = 50, offset: int = 0):
+        """search questions and answers, return the ranked hits with snippets."""
+        if self.connection is None or not keyword:
+            return []
+
+        # the queued writes should be searched too.
+        self.flush()
+
+        try:
+            # the trigram tokenizer needs at least 3 characters.
+            if self.full_text_search and len(keyword) >= 3:
+                with self.connection_lock:
+                    rows = self.connection.execute(
+                        "SELECT h.timestamp, h.question, "
+                        "snippet(histories_fts, -1, '【', '】', '...', 16) AS snippet "
+                        "FROM histories_fts JOIN histories h ON h.id = histories_fts.rowid "
+                        "WHERE histories_fts MATCH ? ORDER BY bm25(histories_fts, 5.0, 1.0) LIMIT ? OFFSET ?",
+                        ('"' + keyword.replace('"', '""') + '"', limit, offset)).fetchall()
+                return [dict(row) for row in rows]
+
+            if self.full_text_search and len(keyword) == 2 and CJK_PATTERN.fullmatch(keyword):
+                # most Chinese words have 2 characters, they are searched in the bigram index.
+                with self.connection_lock:
+                    rows = self.connection.execute(
+                        "SELECT h.timestamp, h.question, h.answer "
+                        "FROM histories_bigram JOIN histories h ON h.id = histories_bigram.rowid "
+                        "WHERE histories_bigram MATCH ? ORDER BY bm25(histories_bigram, 5.0, 1.0) LIMIT ? OFFSET ?",
+                        ('"' + keyword + '"', limit, offset)).fetchall()
+            else:
+                escaped_keyword = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                with self.connection_lock:
+                    rows = self.connection.execute(
+                        "SELECT timestamp, question, answer FROM histories "
+                        "WHERE question LIKE ?1 ESCAPE '\\' OR answer LIKE ?1 ESCAPE '\\' "
+                        "ORDER BY question LIKE ?1 ESCAPE '\\' DESC, timestamp DESC, id LIMIT ?2 OFFSET ?3",
+                        (f"%{escaped_keyword}%", limit, offset)).fetchall()
+        except sqlite3.Error:
+            return []
+
+        return [{
+            'timestamp': row['timestamp'],
+            'question': row['question'],
+            'snippet': self._make_snippet(row['question'], keyword) or self._make_snippet(row['answer'], keyword)
+        } for row in rows]
     def enum_question(self):
         """enumerate all question sorted by timestamp."""
-        histories = self._load_histories()
-        sorted_histories = sorted(histories, key=lambda x: x['timestamp'], reverse=True)
-        return [item for item in sorted_histories]
+        self._ensure_cache()
+        return list(self.cached_histories)
     def clear_history(self):
         """clear all history"""
+        if self.connection is None:
+            return False
+
+        self.writer.enqueue("DELETE FROM histories")
+
+        self.cached_histories = []
+        self.cached_index = {}
+        return True
+    def flush(self):
+        """wait until all histories are written into the database."""
+        if self.writer is not None:
+            self.writer.flush()
+    def close(self):
+        """write the pending histories and close the history database."""
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+    def _invalidate_cache(self):
+        """reload the cache from the database on next access."""
+        self.cached_data_version = None
+
+    def _ensure_cache(self):
+        """load histories into cache once, reload them only if another connection changed the database."""
+        if self.connection is None:
+            self.cached_histories = []
+            self.cached_index = {}
+            return
+
+        try:
+            # data_version changes only when other connections commit.
+            with self.connection_lock:
+                data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            if self.cached_histories is not None and data_version == self.cached_data_version:
+                return
+
+            # the queued writes must be in the database before reloading.
+            self.flush()
+            with self.connection_lock:
+                data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+                rows = self.connection.execute(
+                    f"SELECT {CACHED_COLUMNS} FROM histories ORDER BY timestamp DESC, id").fetchall()
+        except sqlite3.Error:
+            if self.cached_histories is None:
+                self.cached_histories = []
+            return
+
+        self.cached_data_version = data_version
+        self.cached_histories = [dict(row) for row in rows]
+
+        # the first record of each timestamp is indexed.
+        self.cached_index = {}
+        for item in self.cached_histories:
+            self.cached_index.setdefault(item['timestamp'], item)
+    def _load_answer(self, item):
+        """return the history of the cached item with its answer, or None if it has been removed."""
         try:
-            if os.path.exists(self.history_file):
-                os.remove(self.history_file)
+            if item['id'] is None:
+                # the history of this session, find its id once it is written.
+                self.flush()
+                with self.connection_lock:
+                    row = self.connection.execute(
+                        "SELECT id, answer FROM histories WHERE timestamp = ? ORDER BY id LIMIT 1",
+                        (item['timestamp'],)).fetchone()
+                if row is not None:
+                    item['id'] = row['id']
+            else:
+                with self.connection_lock:
+                    row = self.connection.execute(
+                        "SELECT answer FROM histories WHERE id = ?", (item['id'],)).fetchone()
+        except sqlite3.Error:
+            return None
+
+        if row is None:
+            return None
+
+        return {
+            'timestamp': item['timestamp'],
+            'pre_timestamp': item['pre_timestamp'],
+            'question': item['question'],
+            'answer': row['answer']
+        }
+    def _open_database(self):
+        """open the history database and create tables if necessary."""
+        try:
+            # make sure the directory is existing.
+            os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+
+            connection = sqlite3.connect(self.history_file, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+
+            # WAL allows several QGIS instances to share the same database.
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS histories ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "timestamp INTEGER NOT NULL, "
+                    "pre_timestamp INTEGER NOT NULL DEFAULT 0, "
+                    "question TEXT NOT NULL DEFAULT '', "
+                    "answer TEXT NOT NULL DEFAULT '')")
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_histories_timestamp ON histories (timestamp)")
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_histories_pre_timestamp ON histories (pre_timestamp)")
+                # covers the cached columns, so that loading the cache never reads the pages of answers.
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_histories_cached "
+                                   "ON histories (timestamp DESC, id, pre_timestamp, question)")
+
+                # the questions answered by histories.
+                AnswerCache.create_table(connection)
+        except (sqlite3.Error, OSError):
+            return None
+
+        self._migrate_legacy_histories(connection)
+        self.full_text_search = self._create_full_text_index(connection) and self._create_bigram_index(connection)
+        return connection
+    def _create_full_text_index(self, connection):
+        """create the full-text index over questions and answers, return False if FTS5 is unavailable."""
+        try:
+            existing = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'histories_fts'").fetchone()
+            if existing:
                 return True
+
+            # the trigram tokenizer works for Chinese text without word segmentation.
+            with connection:
+                connection.execute(
+                    "CREATE VIRTUAL TABLE histories_fts USING fts5("
+                    "question, answer, content='histories', content_rowid='id', tokenize='trigram')")
+
+                # keep the index up to date in the same transaction as the histories.
+                connection.execute(
+                    "CREATE TRIGGER IF NOT EXISTS histories_fts_insert AFTER INSERT ON histories BEGIN "
+                    "INSERT INTO histories_fts (rowid, question, answer) VALUES (new.id, new.question, new.answer); "
+                    "END")
+                connection.execute(
+                    "CREATE TRIGGER IF NOT EXISTS histories_fts_delete AFTER DELETE ON histories BEGIN "
+                    "INSERT INTO histories_fts (histories_fts, rowid, question, answer) "
+                    "VALUES ('delete', old.id, old.question, old.answer); "
+                    "END")
+
+                # index the existing histories.
+                connection.execute("INSERT INTO histories_fts (histories_fts) VALUES ('rebuild')")
             return True
-        except OSError:
+        except sqlite3.Error:
             return False
-    def _load_histories(self):
-        """load history from file."""
-        if not os.path.exists(self.history_file):
-            return []
+    def _create_bigram_index(self, connection):
+        """create the index of CJK bigrams over questions and answers, return False if it fails."""
+        try:
+            existing = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'histories_bigram'").fetchone()
+            if existing:
+                return True
+
+            # every bigram is a token of unicode61, the rows are inserted with the histories by put_history.
+            with connection:
+                connection.execute(
+                    "CREATE VIRTUAL TABLE histories_bigram USING fts5(question, answer, tokenize='unicode61')")
+                connection.execute(
+                    "CREATE TRIGGER IF NOT EXISTS histories_bigram_delete AFTER DELETE ON histories BEGIN "
+                    "DELETE FROM histories_bigram WHERE rowid = old.id; "
+                    "END")
+
+                # index the existing histories.
+                rows = connection.execute("SELECT id, question, answer FROM histories")
+                connection.executemany(
+                    "INSERT INTO histories_bigram (rowid, question, answer) VALUES (?, ?, ?)",
+                    ((row['id'], self._cjk_bigrams(row['question']), self._cjk_bigrams(row['answer'])) for row in rows))
+            return True
+        except sqlite3.Error:
+            return False
+    @staticmethod
+    def _cjk_bigrams(text):
+        """the overlapping bigrams of the CJK runs in text, separated by spaces."""
+        return " ".join(" ".join(map(operator.add, run, run[1:])) for run in CJK_RUN_PATTERN.findall(text))
+    def _make_snippet(self, text, keyword, context=32):
+        """cut the text around the first keyword."""
+        position = text.lower().find(keyword.lower())
+        if position < 0:
+            return ""
+
+        start = max(0, position - context)
+        end = min(len(text), position + len(keyword) + context)
+        return ("..." if start > 0 else "") + text[start:position] + "【" + text[position:position + len(keyword)] + \
+            "】" + text[position + len(keyword):end] + ("..." if end < len(text) else "")
+    def _migrate_legacy_histories(self, connection):
+        """import the histories of the old JSON file only once."""
+        if not os.path.exists(self.legacy_history_file):
+            return
 
         try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.legacy_history_file, 'r', encoding='utf-8') as f:
+                histories = json.load(f)
         except (json.JSONDecodeError, IOError):
-            return []
-    def _save_histories(self, histories):
-        """save history to file."""
+            histories = []
+
         try:
-            # make sure the directory is existing.
-            os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+            with connection:
+                connection.executemany(
+                    f"INSERT INTO histories ({HISTORY_COLUMNS}) VALUES (?, ?, ?, ?)",
+                    [(item.get('timestamp', 0), item.get('pre_timestamp', 0),
+                      item.get('question', ''), item.get('answer', '')) for item in histories])
 
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(histories, f, ensure_ascii=False, indent=2)
-        except IOError:
+            # keep the old file as backup, so that it would not be imported again.
+            os.replace(self.legacy_history_file, self.legacy_history_file + ".bak")
+        except (sqlite3.Error, OSError):
             pass
     def __get_history_file_path(self):
         """get the history file path"""
         temp_dir = QStandardPaths.writableLocation(QStandardPaths.TempLocation)
+        return os.path.join(temp_dir, "qgis-chinese-ai-assistant-plugin.db")
+    def __get_legacy_history_file_path(self):
+        """get the history file path of the old versions"""
+        temp_dir = QStandardPaths.writableLocation(QStandardPaths.TempLocation)
         return os.path.join(temp_dir, "qgis-chinese-ai-assistant-plugin.dat")
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                                  Image Cache
+  Keep the downloaded images on disk, and the decoded ones in memory.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from qgis.PyQt.QtCore import (QStandardPaths, QObject, QRunnable, QThreadPool, QBuffer, QByteArray, QIODevice,
+                              QSize, Qt, pyqtSignal)
+from qgis.PyQt.QtGui import QImage, QImageReader
+
+
+class DiskImageCache:
+    """
+    Store the image files by the hash of their URL, evict the least recently used
+    files once the total size exceeds max_size. The ETag and Last-Modified of every
+    file are kept, so that the stale file could be revalidated by a conditional request.
+    """
+
+    # the file is used without revalidation within this time.
+    FRESH_TIME = 24 * 3600
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        temp_dir = QStandardPaths.writableLocation(QStandardPaths.TempLocation)
+        self.cache_dir = os.path.join(temp_dir, "qgis-chinese-ai-assistant-images")
+        self.index_file = os.path.join(self.cache_dir, "index.json")
+        self.max_size = max_size
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.entries = self._load()
+
+    @staticmethod
+    def cache_key(url: str):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get(self, url: str):
+        """return the entry and the content of file, or (None, None)."""
+        key = self.cache_key(url)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+
+        try:
+            with open(self._file_path(key), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            # the file has been removed by others.
+            del self.entries[key]
+            self._save()
+            return None, None
+
+        entry["accessed"] = time.time()
+        return entry, data
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get("validated", 0) < self.FRESH_TIME
+
+    def put(self, url: str, data: bytes, etag="", last_modified=""):
+        key = self.cache_key(url)
+        try:
+            # write to a temporary file first, so the image is never half written.
+            temp_file = self._file_path(key) + ".tmp"
+            with open(temp_file, 'wb') as f:
+                f.write(data)
+            os.replace(temp_file, self._file_path(key))
+        except (IOError, OSError):
+            return
+
+        now = time.time()
+        self.entries[key] = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": len(data),
+            "accessed": now,
+            "validated": now
+        }
+        self._evict()
+        self._save()
+
+    def remove(self, url: str):
+        key = self.cache_key(url)
+        if self.entries.pop(key, None) is not None:
+            try:
+                os.remove(self._file_path(key))
+            except OSError:
+                pass
+            self._save()
+
+    def mark_validated(self, url: str):
+        """the server confirms that the file is not modified."""
+        entry = self.entries.get(self.cache_key(url))
+        if entry is not None:
+            entry["validated"] = entry["accessed"] = time.time()
+            self._save()
+
+    def total_size(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def _evict(self):
+        total_size = self.total_size()
+        if total_size <= self.max_size:
+            return
+
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]["accessed"]):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(self._file_path(key))
+            except OSError:
+                pass
+            total_size -= entry["size"]
+            del self.entries[key]
+
+    def _file_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return {}
+
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return {}
+
+    def _save(self):
+        try:
+            temp_file = self.index_file + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_file, self.index_file)
+        except (IOError, OSError):
+            pass
+
+
+class MemoryImageCache:
+    """
+    Decoded images in LRU order, bounded by the total bytes of pixels. The original
+    of every image is kept with its display copy, so it could be scaled again.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, url: str):
+        """return (original, display image), or None."""
+        entry = self.entries.get(url)
+        if entry is not None:
+            self.entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, original, image):
+        self.remove(url)
+        self.entries[url] = (original, image)
+        self.total_bytes += self._entry_bytes(original, image)
+
+        # evict the least recently used images, but always keep the newest one.
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted_entry = self.entries.popitem(last=False)
+            self.total_bytes -= self._entry_bytes(*evicted_entry)
+
+    def remove(self, url: str):
+        entry = self.entries.pop(url, None)
+        if entry is not None:
+            self.total_bytes -= self._entry_bytes(*entry)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    @staticmethod
+    def _entry_bytes(original, image):
+        # the display image shares pixels with the original if it is not scaled.
+        if image.cacheKey() == original.cacheKey():
+            return original.sizeInBytes()
+        return original.sizeInBytes() + image.sizeInBytes()
+
+
+class ImageDecodeSignals(QObject):
+    # url, target width, original image, display image.
+    decoded = pyqtSignal(str, int, QImage, QImage)
+    # url, target width.
+    failed = pyqtSignal(str, int)
+
+
+class ImageDecodeTask(QRunnable):
+    """Decode the image data, or take the cached original, and shrink it to the target width in a pool thread."""
+
+    # the larger original is decoded at this width, which is wide enough for any dock.
+    MAX_ORIGINAL_WIDTH = 2048
+
+    def __init__(self, url, width, image_data=None, original=None):
+        super().__init__()
+        self.url = url
+        self.width = width
+        self.image_data = image_data
+        self.original = original
+        self.signals = ImageDecodeSignals()
+
+    def run(self):
+        original = self.original
+        if original is None:
+            original = self._decode()
+            if original.isNull():
+                self.signals.failed.emit(self.url, self.width)
+                return
+
+        # shrink the large image
+        if 0 < self.width < original.width():
+            image = original.scaledToWidth(self.width, Qt.SmoothTransformation)
+        else:
+            image = original
+
+        self.signals.decoded.emit(self.url, self.width, original, image)
+
+    def _decode(self):
+        buffer = QBuffer()
+        buffer.setData(QByteArray(self.image_data))
+        buffer.open(QIODevice.ReadOnly)
+
+        # decode the huge image at a smaller size directly, without the full size pixels in memory.
+        reader = QImageReader(buffer)
+        size = reader.size()
+        if size.isValid() and size.width() > self.MAX_ORIGINAL_WIDTH:
+            reader.setScaledSize(QSize(self.MAX_ORIGINAL_WIDTH,
+                                       max(1, round(size.height() * self.MAX_ORIGINAL_WIDTH / size.width()))))
+        return reader.read()
+
+
+class ImageCache:
+    """The image caches shared by all chatbot browsers."""
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = ImageCache()
+        return cls._instance
+
+    @classmethod
+    def release(cls):
+        """drop the decoded images when the plugin is unloaded, the files are kept."""
+        if cls._instance is not None:
+            cls._instance.thread_pool.clear()
+            cls._instance.thread_pool.waitForDone(1000)
+            cls._instance.memory.clear()
+            cls._instance = None
+
+    def __init__(self):
+        self.disk = DiskImageCache()
+        self.memory = MemoryImageCache()
+
+        # decode and scale images out of the GUI thread.
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(2)
+
+    def decode(self, task: ImageDecodeTask):
+        self.thread_pool.start(task)
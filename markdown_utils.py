@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                                 Markdown Utils
+  Helpers for dealing with the streamed markdown content of the chatbot.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import re
+
+LIST_ITEM_PATTERN = re.compile(r'^\s*(?:[-*+]|\d+[.)])(?:\s|$)')
+
+# the network image of markdown, or of the upl-image-preview block.
+IMAGE_URL_PATTERN = re.compile(
+    r'!\[[^\]]*\]\(\s*(https?://[^)\s]+)[^)]*\)|\[upl-image-preview[^\]]*?url=(https?://[^\s\]]+)[^\]]*\]',
+    re.IGNORECASE)
+
+# ![alt](url) image of markdown, the alt text and url never contain brackets of their own kind,
+# so that a run of unclosed "![" is skipped in linear time.
+MARKDOWN_IMAGE_PATTERN = re.compile(r'!\[([^\[\]]*)\]\(([^()]+)\)')
+
+# the upl-image-preview block, or the markdown image, rewritten when the answer is finished.
+# Both start with the literal "[", which lets the regex engine skip the plain text quickly.
+IMAGE_BLOCK_PATTERN = re.compile(
+    r'\[(?:(?i:upl-image-preview)[^\]]*?(?i:url)=(?P<upl_url>[^\s\]]+)[^\]]*\]'
+    r'|(?<=!\[)(?P<alt>[^\[\]]*)\]\((?P<url>[^()]+)\))')
+
+
+def finalize_images(markdown_text: str, failed_images=()):
+    """
+    Convert the upl-image-preview blocks to markdown images, and the failed images
+    to links, in a single scan of the text.
+    """
+    parts = []
+    position = 0
+    for match in IMAGE_BLOCK_PATTERN.finditer(markdown_text):
+        upl_url = match.group('upl_url')
+        if upl_url is not None:
+            image_mark = "" if upl_url in failed_images else "!"
+            parts.append(markdown_text[position:match.start()])
+            parts.append(f"\n\n{image_mark}[Image]({upl_url})")
+        elif match.group('url') in failed_images:
+            # the link is the image without the "!" before the match.
+            parts.append(markdown_text[position:match.start() - 1])
+            parts.append(match.group(0))
+        else:
+            continue
+        position = match.end()
+
+    if not parts:
+        return markdown_text
+
+    parts.append(markdown_text[position:])
+    return "".join(parts)
+
+
+class MarkdownBlockSplitter:
+    """
+    Find the offset up to which a growing markdown text consists of finished blocks.
+
+    Only the newly appended complete lines are scanned on every call, so the cost
+    is proportional to the appended text rather than to the whole content.
+
+    Every list item is committed once the next item starts, and the lines of a code
+    fence are committed one by one, so that a long list or code block is never the
+    open block. The committed ranges are taken by take_segments() with their kind:
+    BLOCKS is markdown to render, CODE_LINES are plain lines appended to the code
+    block rendered before them, and FENCE_END is the closing fence, which needs no
+    rendering.
+    """
+
+    BLOCKS = 0
+    CODE_LINES = 1
+    FENCE_END = 2
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, offset=0):
+        # offset of the next unscanned line.
+        self.scan_offset = offset
+        # offset up to which all blocks are finished.
+        self.committed_offset = offset
+        # offset right after a blank line, waiting for the next line to confirm it.
+        self.pending_offset = -1
+        self.fence_marker = ""
+        # the count of lines committed in the open fence.
+        self.fence_lines = 0
+        self.in_list = False
+        # the committed (end offset, kind) not taken yet.
+        self.segments = []
+
+    def feed(self, text: str) -> int:
+        """scan the new complete lines of text and return the committed offset."""
+        while True:
+            line_end = text.find('\n', self.scan_offset)
+            if line_end < 0:
+                break
+
+            line_start = self.scan_offset
+            self.scan_offset = line_end + 1
+            self._scan_line(text[line_start:line_end], line_start, self.scan_offset)
+
+        return self.committed_offset
+
+    def take_segments(self):
+        """return and forget the segments committed since the last call."""
+        segments = self.segments
+        self.segments = []
+        return segments
+
+    def in_code_lines(self):
+        """the open text is a partial line of a code block which has been rendered."""
+        return bool(self.fence_marker) and self.fence_lines > 0
+
+    def _commit(self, offset, kind=BLOCKS):
+        if offset <= self.committed_offset:
+            return
+
+        # the adjacent segments of the same kind are rendered at once.
+        if self.segments and self.segments[-1][1] == kind:
+            self.segments[-1] = (offset, kind)
+        else:
+            self.segments.append((offset, kind))
+        self.committed_offset = offset
+
+    def _scan_line(self, line, line_start, next_line_start):
+        stripped = line.strip()
+
+        # inside a code fence, only the closing fence matters.
+        if self.fence_marker:
+            if stripped.startswith(self.fence_marker) and not stripped.strip(self.fence_marker[0]):
+                self.fence_marker = ""
+                self.in_list = False
+                if self.fence_lines:
+                    self._commit(next_line_start, self.FENCE_END)
+                else:
+                    # the empty fence is rendered as a whole.
+                    self._commit(next_line_start)
+            else:
+                # the first line is rendered with the opening fence, the others are appended to it.
+                self._commit(next_line_start, self.CODE_LINES if self.fence_lines else self.BLOCKS)
+                self.fence_lines += 1
+            return
+
+        if not stripped:
+            self.pending_offset = next_line_start
+            return
+
+        indented = line[:1] in (' ', '\t')
+        is_list_item = LIST_ITEM_PATTERN.match(line) is not None
+
+        if stripped.startswith(('```', '~~~')) and not indented:
+            # a fence always opens a new block.
+            self._commit(line_start)
+            self.pending_offset = -1
+            self.fence_marker = stripped[:3]
+            self.fence_lines = 0
+            return
+
+        if self.pending_offset >= 0:
+            # indented lines and further list items keep the previous block open.
+            if not indented and not (is_list_item and self.in_list):
+                self._commit(self.pending_offset)
+            self.pending_offset = -1
+
+        if is_list_item:
+            if self.in_list and not indented:
+                # the previous item is finished.
+                self._commit(line_start)
+            self.in_list = True
+        elif not indented:
+            self.in_list = False
+
+        if stripped.startswith('#') and not self.in_list:
+            # heading is a single line block.
+            self.pending_offset = next_line_start
+
+
+class ImageUrlScanner:
+    """
+    Find the image URLs in streamed text as soon as they are complete.
+
+    Only the trailing unfinished image syntax is kept between calls, so every
+    chunk is scanned once.
+    """
+
+    # a longer unfinished image syntax is dropped, so that the carry never grows with the line.
+    MAX_CARRY_LENGTH = 2048
+
+    # the unfinished markdown image, "![alt", "![alt]" or "![alt](url".
+    PARTIAL_IMAGE_PATTERN = re.compile(r'!\[[^\]\n]*(?:\](?:\([^)\n]*)?)?')
+    UPL_IMAGE_PREFIX = "[upl-image-preview"
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.carry = ""
+        self.seen_urls = set()
+
+    def feed(self, text: str):
+        """scan the new text and return the URLs never found before."""
+        text = self.carry + text
+
+        urls = []
+        position = 0
+        for match in IMAGE_URL_PATTERN.finditer(text):
+            position = match.end()
+            url = match.group(1) or match.group(2)
+            if url not in self.seen_urls:
+                self.seen_urls.add(url)
+                urls.append(url)
+
+        # an image syntax cut by the end of chunk is scanned again with the next chunk.
+        self.carry = self._unfinished_image(text, position)
+        return urls
+
+    def _unfinished_image(self, text, position):
+        """the trailing text after position which may still become an image."""
+        tail_start = max(position, len(text) - self.MAX_CARRY_LENGTH, text.rfind('\n') + 1)
+        tail = text[tail_start:]
+
+        starts = []
+        image = tail.rfind('![')
+        if image >= 0 and self.PARTIAL_IMAGE_PATTERN.fullmatch(tail, image):
+            starts.append(image)
+        elif tail.endswith('!'):
+            starts.append(len(tail) - 1)
+
+        # the upl-image-preview block, or a prefix of its name.
+        lower_tail = tail.lower()
+        upl_image = lower_tail.rfind(self.UPL_IMAGE_PREFIX)
+        if upl_image >= 0 and ']' not in tail[upl_image:]:
+            starts.append(upl_image)
+        else:
+            bracket = tail.rfind('[')
+            if bracket >= 0 and self.UPL_IMAGE_PREFIX.startswith(lower_tail[bracket:]):
+                starts.append(bracket)
+
+        return tail[min(starts):] if starts else ""
+
+
+class HtmlTagStripper:
+    """
+    Remove the html tags from streamed markdown text, except in code spans and fences.
+
+    Only the new text is scanned on every call. A tag, a backtick run or the start
+    of a line which is cut by the end of chunk is held back until the next chunk
+    completes it, so the cost is proportional to the chunk.
+    """
+
+    # a longer unfinished tag is taken as plain text, so that a stray "<" never holds the line back for long.
+    MAX_TAG_LENGTH = 256
+
+    # the next character which may change the output or the state, outside of fences.
+    SPECIAL_PATTERN = re.compile(r'[<`\n]')
+    TAG_PATTERN = re.compile(r'</?[a-zA-Z][^<>\n]*>')
+    PARTIAL_TAG_PATTERN = re.compile(r'</?(?:[a-zA-Z][^<>\n]*)?\Z')
+    BACKTICKS_PATTERN = re.compile(r'`+')
+    # the start of line which may still turn into a fence or a blank line.
+    PARTIAL_LINE_START_PATTERN = re.compile(r'[ \t]*(?:`{0,2}|~{0,2})\Z')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.carry = ""
+        self.line_start = True
+        # the opening fence of the code block, and the text of current line in it.
+        self.fence_marker = ""
+        self.fence_line = ""
+        # the count of backticks opening current code span, 0 out of code span.
+        self.code_ticks = 0
+
+    def feed(self, text: str) -> str:
+        """return the cleaned text which is safe to append, the undecided tail is kept."""
+        text = self.carry + text
+        self.carry = ""
+
+        parts = []
+        position = 0
+        length = len(text)
+        while position < length:
+            if self.fence_marker:
+                position = self._feed_fence(text, position, parts)
+                continue
+
+            if self.line_start:
+                if self.PARTIAL_LINE_START_PATTERN.match(text, position):
+                    break
+                position = self._feed_line_start(text, position, parts)
+                continue
+
+            match = self.SPECIAL_PATTERN.search(text, position)
+            if match is None:
+                parts.append(text[position:])
+                position = length
+                break
+
+            special = match.start()
+            parts.append(text[position:special])
+            position = special
+            char = text[special]
+
+            if char == '\n':
+                parts.append(char)
+                position += 1
+                self.line_start = True
+            elif char == '`':
+                run = self.BACKTICKS_PATTERN.match(text, special)
+                if run.end() == length:
+                    # the run may go on in the next chunk.
+                    break
+                run_length = run.end() - special
+                if not self.code_ticks:
+                    self.code_ticks = run_length
+                elif run_length == self.code_ticks:
+                    self.code_ticks = 0
+                parts.append(run.group())
+                position = run.end()
+            elif self.code_ticks:
+                parts.append(char)
+                position += 1
+            else:
+                tag = self.TAG_PATTERN.match(text, special)
+                if tag is not None:
+                    position = tag.end()
+                elif length - special < self.MAX_TAG_LENGTH and self.PARTIAL_TAG_PATTERN.match(text, special):
+                    break
+                else:
+                    parts.append(char)
+                    position += 1
+
+        self.carry = text[position:]
+        return "".join(parts)
+
+    def flush(self) -> str:
+        """the text is finished, return the held back tail as it is."""
+        carry = self.carry
+        self.reset()
+        return carry
+
+    def _feed_line_start(self, text, position, parts):
+        """deal with the start of a line outside of fences, return the next position."""
+        line_end = text.find('\n', position)
+        line = text[position:] if line_end < 0 else text[position:line_end]
+        stripped = line.strip()
+
+        if not stripped:
+            # a blank line ends the paragraph, and the unclosed code span with it.
+            self.code_ticks = 0
+        elif stripped.startswith(('```', '~~~')) and line[:1] not in (' ', '\t'):
+            # the fence line is kept as it is.
+            self.code_ticks = 0
+            self.fence_marker = stripped[:3]
+            self.fence_line = ""
+            parts.append(line)
+            self.line_start = False
+            return position + len(line)
+
+        self.line_start = False
+        return position
+
+    def _feed_fence(self, text, position, parts):
+        """copy the text in code fence, return the next position."""
+        line_end = text.find('\n', position)
+        if line_end < 0:
+            self.fence_line += text[position:]
+            parts.append(text[position:])
+            return len(text)
+
+        line = (self.fence_line + text[position:line_end]).strip()
+        parts.append(text[position:line_end + 1])
+
+        # the opening line has been copied by _feed_line_start, only the following lines could close the fence.
+        if self.line_start and line.startswith(self.fence_marker) and not line.strip(self.fence_marker[0]):
+            self.fence_marker = ""
+        self.fence_line = ""
+        self.line_start = True
+        return line_end + 1
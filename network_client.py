@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                                 Network Client
+  A long-lived network client shared by the whole plugin.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import requests
+from PyQt5.QtCore import QObject, QUrl
+from PyQt5.QtNetwork import QNetworkAccessManager
+
+from .global_defs import *
+
+
+class NetworkClient(QObject):
+    """
+    Keep one QNetworkAccessManager and one requests session for all requests,
+    so that TCP and TLS connections to the server are kept alive and reused.
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = NetworkClient()
+        return cls._instance
+
+    @classmethod
+    def release(cls):
+        """close the connections when the plugin is unloaded."""
+        if cls._instance is not None:
+            cls._instance.session.close()
+            cls._instance.deleteLater()
+            cls._instance = None
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        # the QNetworkAccessManager keeps connections alive for every host.
+        self.network_manager = QNetworkAccessManager(self)
+
+        # the session keeps connections alive for the synchronous requests.
+        self.session = requests.Session()
+
+        # whether the server accepts gzip request bodies, it turns off once rejected.
+        self.compress_requests = True
+
+    def post_json(self, path: str, data: dict, timeout=2):
+        """send a synchronous POST request to the AI server."""
+        return self.session.post(AI_SERVER_DOMAIN + path, json=data, timeout=timeout)
+
+    def prewarm(self):
+        """connect to the AI server in advance, so that the first question does not wait for handshakes."""
+        url = QUrl(AI_SERVER_DOMAIN)
+        if url.scheme() == "https":
+            self.network_manager.connectToHostEncrypted(url.host(), url.port(443))
+        else:
+            self.network_manager.connectToHost(url.host(), url.port(80))
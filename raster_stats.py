@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                               Raster Statistics
+  Compute raster band statistics in background and cache them on disk.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import os
+
+from qgis.PyQt.QtCore import QStandardPaths
+from qgis.core import QgsTask, QgsProviderRegistry, QgsRasterBandStats, QgsRectangle
+
+
+class RasterStatsCache:
+    """Band statistics keyed by data source, modification time and size of file."""
+
+    MAX_ENTRIES = 500
+
+    def __init__(self):
+        temp_dir = QStandardPaths.writableLocation(QStandardPaths.TempLocation)
+        self.cache_file = os.path.join(temp_dir, "qgis-chinese-ai-assistant-raster-stats.json")
+        self.entries = self._load()
+
+    @staticmethod
+    def cache_key(layer):
+        """build the key of layer, the statistics are invalid once the file is modified."""
+        source = layer.source()
+        path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), source).get("path", "")
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            return f"{source}|{stat.st_mtime_ns}|{stat.st_size}"
+        return source
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, bands_stats):
+        self.entries.pop(key, None)
+        self.entries[key] = bands_stats
+
+        # drop the oldest entries.
+        while len(self.entries) > self.MAX_ENTRIES:
+            self.entries.pop(next(iter(self.entries)))
+
+        self._save()
+
+    def _load(self):
+        if not os.path.exists(self.cache_file):
+            return {}
+
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return {}
+
+    def _save(self):
+        try:
+            # write to a temporary file first, so the cache is never half written.
+            temp_file = self.cache_file + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(temp_file, self.cache_file)
+        except (IOError, OSError):
+            pass
+
+
+class RasterStatsTask(QgsTask):
+    """Compute the statistics of all bands with a cloned data provider."""
+
+    def __init__(self, layer, cache_key):
+        super().__init__(f"Raster statistics: {layer.name()}", QgsTask.CanCancel)
+        self.layer_id = layer.id()
+        self.cache_key = cache_key
+
+        # the provider of layer must not be used outside the main thread.
+        self.provider = layer.dataProvider().clone()
+        self.bands_stats = []
+
+    def run(self):
+        band_count = self.provider.bandCount()
+
+        # In order to shorten time of statistic, use the custom sample size.
+        customSampleSize = int(max(self.provider.xSize(), self.provider.ySize()) / 256)
+
+        for band in range(1, band_count + 1):
+            if self.isCanceled():
+                return False
+
+            stats = self.provider.bandStatistics(band, QgsRasterBandStats.All, QgsRectangle(), customSampleSize)
+            self.bands_stats.append({
+                "minimum": stats.minimumValue,
+                "maximum": stats.maximumValue,
+                "mean": stats.mean,
+                "std_dev": stats.stdDev
+            })
+            self.setProgress(band * 100 / band_count)
+        return True
@@ -31,6 +31,7 @@ from qgis.PyQt.QtWidgets import QDialog, QMessageBox
 from qgis.core import QgsSettings
 
 from .global_defs import *
+from .network_client import NetworkClient
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'setting_dialog.ui'))
@@ -56,6 +57,25 @@ class SettingDialog(QDialog, FORM_CLASS):
 
         multi_turn = gSetting.value(MULTI_TURN_TAG, "2")
         self.cbChatTurn.setCurrentText(multi_turn)
+
+        # answer cache
+        self.cbAnswerCache.setChecked(gSetting.value(ANSWER_CACHE_TAG, "false") == "true")
+        self.sbAnswerCacheTtl.setValue(int(gSetting.value(ANSWER_CACHE_TTL_TAG, "168")))
+        self.sbAnswerCacheSize.setValue(int(gSetting.value(ANSWER_CACHE_SIZE_TAG, "200")))
+
+        # workspace context
+        self.sbWorkspaceBudget.setValue(int(gSetting.value(WORKSPACE_BUDGET_TAG, "16")))
+
+        # connection
+        self.sbRetryCount.setValue(int(gSetting.value(RETRY_COUNT_TAG, "3")))
+        self.sbRetryDelay.setValue(int(gSetting.value(RETRY_DELAY_TAG, "500")))
+        self.sbMaxConcurrentChats.setValue(int(gSetting.value(MAX_CONCURRENT_CHATS_TAG, "2")))
+        self.cbCompressRequest.setChecked(gSetting.value(COMPRESS_REQUEST_TAG, "false") == "true")
+        self.cbConversationState.setChecked(gSetting.value(CONVERSATION_STATE_TAG, "false") == "true")
+
+        # diagnostics
+        self.cbTimingOverlay.setChecked(gSetting.value(TIMING_OVERLAY_TAG, "false") == "true")
+        self.cbTimingLog.setChecked(gSetting.value(TIMING_LOG_TAG, "false") == "true")
     def handle_click_ok(self):
         email = self.lineEdit.text()
 
@@ -66,6 +86,25 @@ class SettingDialog(QDialog, FORM_CLASS):
         chat_turn = self.cbChatTurn.currentText()
         gSetting.setValue(MULTI_TURN_TAG, chat_turn)
 
+        # answer cache
+        gSetting.setValue(ANSWER_CACHE_TAG, "true" if self.cbAnswerCache.isChecked() else "false")
+        gSetting.setValue(ANSWER_CACHE_TTL_TAG, str(self.sbAnswerCacheTtl.value()))
+        gSetting.setValue(ANSWER_CACHE_SIZE_TAG, str(self.sbAnswerCacheSize.value()))
+
+        # workspace context
+        gSetting.setValue(WORKSPACE_BUDGET_TAG, str(self.sbWorkspaceBudget.value()))
+
+        # connection
+        gSetting.setValue(RETRY_COUNT_TAG, str(self.sbRetryCount.value()))
+        gSetting.setValue(RETRY_DELAY_TAG, str(self.sbRetryDelay.value()))
+        gSetting.setValue(MAX_CONCURRENT_CHATS_TAG, str(self.sbMaxConcurrentChats.value()))
+        gSetting.setValue(COMPRESS_REQUEST_TAG, "true" if self.cbCompressRequest.isChecked() else "false")
+        gSetting.setValue(CONVERSATION_STATE_TAG, "true" if self.cbConversationState.isChecked() else "false")
+
+        # diagnostics
+        gSetting.setValue(TIMING_OVERLAY_TAG, "true" if self.cbTimingOverlay.isChecked() else "false")
+        gSetting.setValue(TIMING_LOG_TAG, "true" if self.cbTimingLog.isChecked() else "false")
+
         super().accept()
 
     def handle_click_cancel(self):
@@ -93,9 +132,9 @@ class SettingDialog(QDialog, FORM_CLASS):
 
         try:
             # send email to server
-            response = requests.post(
-                AI_SERVER_DOMAIN + "/ai/v1/vip/apply",
-                json={"email": email},
+            response = NetworkClient.instance().post_json(
+                "/ai/v1/vip/apply",
+                {"email": email},
                 timeout=2
             )
 
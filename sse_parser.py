@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                                   SSE Parser
+  An incremental parser of the server-sent events stream.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import re
+
+LINE_END_PATTERN = re.compile(rb'\r\n|\r|\n')
+
+
+class SseEvent:
+
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, event, data, event_id, retry):
+        self.event = event
+        self.data = data
+        self.id = event_id
+        self.retry = retry
+
+    def __repr__(self):
+        return f"SseEvent(event={self.event!r}, data={self.data!r}, id={self.id!r})"
+
+
+class SseParser:
+    """
+    Parse the event stream defined by the HTML specification of server-sent events.
+
+    Lines are split on bytes, and a line is decoded only when it is complete, so a
+    multi-byte UTF-8 character split between two packets is never decoded partially.
+    Only the newly arrived bytes are scanned for line endings.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # bytes before this offset contain no line ending.
+        self.scan_offset = 0
+        self.first_line = True
+
+        # fields of the event being parsed.
+        self.data_lines = []
+        self.event_type = ""
+
+        # id and retry are kept between events.
+        self.last_event_id = ""
+        self.retry = None
+
+    @property
+    def buffered_size(self):
+        """the size of the incomplete line."""
+        return len(self.buffer)
+
+    def feed(self, data: bytes):
+        """parse the new data, return the completed events."""
+        self.buffer += data
+
+        events = []
+        line_start = 0
+        position = self.scan_offset
+        while True:
+            match = LINE_END_PATTERN.search(self.buffer, position)
+            if match is None:
+                break
+
+            # a CR at the end may be the first half of CRLF.
+            if match.group() == b'\r' and match.end() == len(self.buffer):
+                break
+
+            event = self._process_line(self.buffer[line_start:match.start()])
+            if event is not None:
+                events.append(event)
+            line_start = position = match.end()
+
+        # keep the incomplete line only.
+        if line_start > 0:
+            del self.buffer[:line_start]
+        self.scan_offset = max(0, len(self.buffer) - 1) if self.buffer.endswith(b'\r') else len(self.buffer)
+        return events
+
+    def _process_line(self, line):
+        text = line.decode('utf-8', errors='replace')
+        if self.first_line:
+            self.first_line = False
+            text = text.lstrip('\ufeff')
+
+        # empty line dispatches the event.
+        if not text:
+            return self._dispatch_event()
+
+        # comment line.
+        if text.startswith(':'):
+            return None
+
+        field, separator, value = text.partition(':')
+        if separator and value.startswith(' '):
+            value = value[1:]
+
+        if field == "data":
+            self.data_lines.append(value)
+        elif field == "event":
+            self.event_type = value
+        elif field == "id":
+            if '\0' not in value:
+                self.last_event_id = value
+        elif field == "retry":
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+    def _dispatch_event(self):
+        if not self.data_lines:
+            self.event_type = ""
+            return None
+
+        event = SseEvent(self.event_type or "message", "\n".join(self.data_lines), self.last_event_id, self.retry)
+        self.data_lines = []
+        self.event_type = ""
+        return event
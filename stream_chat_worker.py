@@ -2,7 +2,7 @@
 """
 /***************************************************************************
                                  Stream Chat Worker
- This is subclass of QThread which support stream chat.
+  A QObject which streams the chat on the Qt event loop of the main thread.
                               -------------------
         begin                : 2025-10-01
         copyright            : (C) 2025 by phoenix-gis
@@ -20,14 +20,45 @@
  ***************************************************************************/
 """
 
+import gzip
 import json
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QTimer
-from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
-from PyQt5.QtCore import QUrl
+import random
+import time
+from PyQt5.QtCore import QObject, pyqtSignal, QUrl, QTimer
+from PyQt5.QtNetwork import QNetworkRequest, QNetworkReply
 
 from .global_defs import *
+from .chat_timing import ChatTiming
+from .network_client import NetworkClient
+from .sse_parser import SseParser
 
-class StreamChatWorker(QThread):
+class StreamChatWorker(QObject):
+
+    # the max size of an incomplete line kept in buffer.
+    MAX_BUFFER_SIZE = 1024 * 1024
+
+    # the errors which may disappear after a while.
+    RETRYABLE_ERRORS = {
+        QNetworkReply.ConnectionRefusedError,
+        QNetworkReply.RemoteHostClosedError,
+        QNetworkReply.HostNotFoundError,
+        QNetworkReply.TimeoutError,
+        QNetworkReply.TemporaryNetworkFailureError,
+        QNetworkReply.NetworkSessionFailedError,
+        QNetworkReply.ProxyConnectionRefusedError,
+        QNetworkReply.ProxyConnectionClosedError,
+        QNetworkReply.ProxyTimeoutError,
+        QNetworkReply.UnknownNetworkError,
+    }
+    RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+    MAX_RETRY_DELAY = 30000
+
+    # the smaller body is not worth compressing.
+    COMPRESS_MIN_SIZE = 1024
+    # the server rejects the compressed body, or fails to decode it.
+    COMPRESSION_REJECTED_STATUS_CODES = {400, 415, 422, 500}
+    # the server has lost the state of conversation.
+    STATE_LOST_STATUS_CODES = {409, 410}
 
     # defines signals.
     # receive chunk signal.
@@ -40,17 +71,48 @@ class StreamChatWorker(QThread):
     stream_ended = pyqtSignal(int)
     # report error signal.
     error_occurred = pyqtSignal(str)
+    # the request will be sent again, the parameters are the attempt and the delay in milliseconds.
+    retrying = pyqtSignal(int, int)
+    # the request is finished, aborted or failed.
+    finished = pyqtSignal()
 
-    def __init__(self, request_data):
-        super().__init__()
+    def __init__(self, request_data, max_retries=3, base_delay=500, parent=None,
+                 compress=False, fallback_request_data=None):
+        super().__init__(parent)
         self.request_data = request_data
-        self.network_manager = QNetworkAccessManager()
+        self.compress = compress
+        self.compressed = False
+
+        # the full request sent instead if the server does not know the conversation.
+        self.fallback_request_data = fallback_request_data
+        self.restart_pending = False
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+        # the shared manager lives in the main thread, and so does this worker.
+        self.network_manager = NetworkClient.instance().network_manager
         self.reply = None
         self.received_chunks = 0
-        self.buffer = ""
+        self.sse_parser = SseParser()
+        self.stopped = False
 
-    def run(self):
-        """execute request"""
+        # the id of the last received event, the interrupted stream is resumed after it.
+        self.last_event_id = ""
+        self.stream_ended_flag = False
+        self.retry_count = 0
+        self.retry_pending = False
+        self.retry_timer = QTimer(self)
+        self.retry_timer.setSingleShot(True)
+        self.retry_timer.timeout.connect(self.start)
+
+        # the timing record of the chat, the session replaces it.
+        self.timing = ChatTiming()
+        self.attempt_start_time = 0
+        self.headers_pending = False
+        self.first_byte_pending = False
+
+    def start(self):
+        """send request, the response is handled in the main event loop."""
         try:
             url = AI_SERVER_DOMAIN + "/ai/v1/chat/stream"
 
@@ -58,72 +120,185 @@ class StreamChatWorker(QThread):
             request = QNetworkRequest(QUrl(url))
             request.setHeader(QNetworkRequest.ContentTypeHeader, "application/json")
             request.setRawHeader(b"Accept", b"text/event-stream")
+            if self.last_event_id:
+                # ask the server to send the events after the last received one only.
+                request.setRawHeader(b"Last-Event-ID", self.last_event_id.encode('utf-8'))
+
+            # a partial line of the interrupted stream is useless, but the id and the retry delay are kept.
+            retry = self.sse_parser.retry
+            self.sse_parser = SseParser()
+            self.sse_parser.last_event_id = self.last_event_id
+            self.sse_parser.retry = retry
+
+            # send post reqeust, compress the body unless the server has rejected it.
+            with self.timing.span("encode_request"):
+                json_data = json.dumps(self.request_data).encode('utf-8')
+                self.compressed = (self.compress and len(json_data) >= self.COMPRESS_MIN_SIZE and
+                                   NetworkClient.instance().compress_requests)
+                if self.compressed:
+                    json_data = gzip.compress(json_data, compresslevel=6)
+                    request.setRawHeader(b"Content-Encoding", b"gzip")
+            self.timing.count("attempts")
+            self.timing.count("request_bytes", len(json_data))
+            self.timing.mark("request_sent")
 
-            # send post reqeust.
-            json_data = json.dumps(self.request_data).encode('utf-8')
             self.reply = self.network_manager.post(request, json_data)
+            self.attempt_start_time = time.perf_counter()
+            self.headers_pending = True
+            self.first_byte_pending = True
 
             # connect read slots.
+            self.reply.metaDataChanged.connect(self.on_meta_data_changed)
             self.reply.readyRead.connect(self.on_ready_read)
             self.reply.finished.connect(self.on_finished)
             self.reply.errorOccurred.connect(self.on_error)
 
-            # keep event loop until finish.
-            self.exec_()
-
         except Exception as e:
             self.error_occurred.emit(self.tr("Network Error:") + str(e))
+            self.finished.emit()
+
+    def stop(self):
+        """abort the request immediately."""
+        if self.stopped:
+            return
+
+        self.stopped = True
+        if self.reply:
+            self.reply.abort()
+        elif self.retry_timer.isActive():
+            # waiting for the next attempt.
+            self.retry_timer.stop()
+            self.finished.emit()
+
+    def on_meta_data_changed(self):
+        """the response headers arrive, so the connection is made."""
+        if self.headers_pending:
+            self.headers_pending = False
+            self.timing.add_span("connect", (time.perf_counter() - self.attempt_start_time) * 1000)
+            self.timing.mark("response_headers")
 
     def on_ready_read(self):
         """deal with raw content"""
         if self.reply:
-            data = self.reply.readAll().data().decode('utf-8')
-            self.buffer += data
-
-            # read every line.
-            lines = self.buffer.split('\n')
-            self.buffer = lines[-1]  # contain the last line.
-
-            for line in lines[:-1]:
-                line = line.strip()
-                if line:
-                    self.process_line(line)
-
-    def process_line(self, line):
-        """deal with every line"""
-        if line.startswith('data: '):
-            try:
-                # remove 'data:'
-                json_str = line[6:]
-                if json_str.strip():
-                    event_data = json.loads(json_str)
-                    event_type = event_data.get('type')
-                    content = event_data.get('content', '')
-
-                    # emit signals.
-                    self.chunk_received.emit(event_data)
-
-                    if event_type == 'chunks':
-                        self.chunks_info_received.emit(content)
-                    elif event_type == 'content':
-                        self.received_chunks += 1
-                        self.content_received.emit(content)
-                    elif event_type == 'end':
-                        self.stream_ended.emit(self.received_chunks)
-
-            except json.JSONDecodeError as e:
-                self.error_occurred.emit(f"JSON Error: {str(e)} - Data: {line}")
-            except Exception as e:
-                self.error_occurred.emit(f"Error: {str(e)}")
+            data = self.reply.readAll().data()
+            if self.first_byte_pending:
+                self.first_byte_pending = False
+                self.timing.add_span("ttfb", (time.perf_counter() - self.attempt_start_time) * 1000)
+                self.timing.mark("first_byte")
+            self.timing.count("bytes_received", len(data))
+
+            with self.timing.span("parse_sse"):
+                events = self.sse_parser.feed(data)
+
+            for event in events:
+                self.last_event_id = event.id
+                self.process_event(event)
+
+            # never keep an endless line in memory.
+            if self.sse_parser.buffered_size > self.MAX_BUFFER_SIZE:
+                self.error_occurred.emit(self.tr("Error: the response line is too long."))
+                self.stop()
+
+    def process_event(self, event):
+        """deal with every event"""
+        try:
+            if event.data.strip():
+                # the slots of signals are not timed here, they render the content.
+                start_time = time.perf_counter()
+                event_data = json.loads(event.data)
+                self.timing.add_span("parse_event", (time.perf_counter() - start_time) * 1000)
+                event_type = event_data.get('type')
+                content = event_data.get('content', '')
+
+                # emit signals.
+                self.chunk_received.emit(event_data)
+
+                if event_type == 'chunks':
+                    self.chunks_info_received.emit(content)
+                elif event_type == 'content':
+                    self.received_chunks += 1
+                    self.timing.mark("first_content")
+                    self.content_received.emit(content)
+                elif event_type == 'end':
+                    self.stream_ended_flag = True
+                    self.timing.mark("stream_end")
+                    self.stream_ended.emit(self.received_chunks)
+
+        except json.JSONDecodeError as e:
+            self.error_occurred.emit(f"JSON Error: {str(e)} - Data: {event.data}")
+        except Exception as e:
+            self.error_occurred.emit(f"Error: {str(e)}")
 
     def on_finished(self):
         """request finished"""
         if self.reply:
+            # the connection is closed before the end of stream.
+            if not self.retry_pending and not self.stopped and not self.stream_ended_flag \
+                    and self.reply.error() == QNetworkReply.NoError and self.last_event_id:
+                self.retry_pending = self._can_retry()
+
             self.reply.deleteLater()
-        self.quit()
+            self.reply = None
+
+        # send the request in another form at once.
+        if self.restart_pending:
+            self.restart_pending = False
+            self.start()
+            return
+
+        if self.retry_pending:
+            self.retry_pending = False
+            self._schedule_retry()
+            return
+
+        self.finished.emit()
 
     def on_error(self, error):
         """report error"""
+        # aborted by user.
+        if self.stopped and error == QNetworkReply.OperationCanceledError:
+            return
+
+        status_code = self.reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if self.received_chunks == 0:
+            if self.compressed and status_code in self.COMPRESSION_REJECTED_STATUS_CODES:
+                # never compress again in this session of QGIS.
+                NetworkClient.instance().compress_requests = False
+                self.restart_pending = True
+                return
+
+            if self.fallback_request_data is not None and status_code in self.STATE_LOST_STATUS_CODES:
+                self.request_data = self.fallback_request_data
+                self.fallback_request_data = None
+                self.restart_pending = True
+                return
+
+        # try again later, the error is reported only when all attempts fail.
+        if (error in self.RETRYABLE_ERRORS or status_code in self.RETRYABLE_STATUS_CODES) and self._can_retry():
+            self.retry_pending = True
+            return
+
         error_msg = f"Error: {self.reply.errorString()}"
         self.error_occurred.emit(error_msg)
-        self.quit()
\ No newline at end of file
+
+    def _can_retry(self):
+        """
+        The request can be sent again if nothing has been shown, or the server
+        tags its events with ids, so that the stream is resumed without repetition.
+        """
+        if self.stopped or self.stream_ended_flag or self.retry_count >= self.max_retries:
+            return False
+        return self.received_chunks == 0 or bool(self.last_event_id)
+
+    def _schedule_retry(self):
+        # the server may suggest the reconnection time by the retry field.
+        base_delay = self.sse_parser.retry if self.sse_parser.retry is not None else self.base_delay
+
+        # exponential backoff with jitter, so that clients do not retry at the same moment.
+        delay = min(base_delay * (2 ** self.retry_count), self.MAX_RETRY_DELAY)
+        delay = int(delay / 2 + random.uniform(0, delay / 2))
+
+        self.retry_count += 1
+        self.timing.count("retries")
+        self.retrying.emit(self.retry_count, delay)
+        self.retry_timer.start(delay)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of AnswerCache, which does not depend on QGIS:
+
+    python -m pytest test
+"""
+
+import os
+import sqlite3
+import sys
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_cache import AnswerCache  # noqa: E402
+
+
+class HistoryManager:
+    """the part of HistoryManager used by AnswerCache, the writes are executed at once."""
+
+    def __init__(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.connection.row_factory = sqlite3.Row
+        self.connection_lock = Lock()
+        self.writer = self
+        self.histories = {}
+        with self.connection:
+            AnswerCache.create_table(self.connection)
+
+    def enqueue(self, sql, parameters=()):
+        with self.connection:
+            self.connection.execute(sql, parameters)
+
+    def retrieve_history(self, timestamp):
+        return self.histories.get(timestamp)
+
+    def add(self, cache, prompt, timestamp, fingerprint="workspace"):
+        self.histories[timestamp] = {"timestamp": timestamp, "question": prompt, "answer": f"answer {timestamp}"}
+        cache.put(prompt, fingerprint, timestamp)
+
+
+def lookup(cache, prompt, fingerprint="workspace"):
+    history_item = cache.lookup(prompt, fingerprint)
+    return history_item["timestamp"] if history_item else None
+
+
+def test_normalize_prompt():
+    assert AnswerCache.normalize_prompt(" How to  clip\tRaster？ ") == "howtoclipraster"
+    assert AnswerCache.normalize_prompt("ＥＰＳＧ：４３２６，投影。") == "epsg4326投影"
+
+
+def test_prompt_identifiers():
+    assert AnswerCache.prompt_identifiers("how to clip raster") == []
+    assert AnswerCache.prompt_identifiers("Buffer roads_2020 by 100 m in EPSG:3857") == ["roads_2020", "100", "epsg:3857"]
+    assert AnswerCache.prompt_identifiers("compute NDVI of the layer \"Land Use\"") == ["ndvi", "land use"]
+    assert AnswerCache.prompt_identifiers("把道路缓冲一百米") == ["一百"]
+    assert AnswerCache.prompt_identifiers("缓冲１００米") == ["100"]
+
+
+def test_exact_match_ignores_whitespace_punctuation_and_case():
+    cache = AnswerCache(HistoryManager())
+    cache.manager.add(cache, "How to clip a raster?", 1)
+    assert lookup(cache, "how to clip a raster") == 1
+    assert lookup(cache, "how to clip a raster", "other workspace") is None
+
+
+def test_near_duplicate_english_prompt():
+    cache = AnswerCache(HistoryManager())
+    cache.manager.add(cache, "how to clip raster", 1)
+    assert lookup(cache, "how to clip a raster") == 1
+    assert lookup(cache, "how to clip vector") is None
+
+
+def test_near_duplicate_chinese_prompt():
+    cache = AnswerCache(HistoryManager())
+    cache.manager.add(cache, "把道路图层缓冲一百米并保存到新图层中", 1)
+    assert lookup(cache, "请把道路图层缓冲一百米并保存到新图层中") == 1
+    assert lookup(cache, "把道路图层缓冲五百米并保存到新图层中") is None
+
+
+def test_near_duplicate_needs_same_identifiers():
+    cache = AnswerCache(HistoryManager())
+    cache.manager.add(cache, "please buffer the roads layer by 100 meters and save it", 1)
+    cache.manager.add(cache, "reproject the roads layer to EPSG:4326 and save it as a new layer", 2)
+    assert lookup(cache, "please buffer the roads layer by 100 meters and save it now") == 1
+    assert lookup(cache, "please buffer the roads layer by 500 meters and save it now") is None
+    assert lookup(cache, "reproject the roads layer to EPSG:3857 and save it as a new layer") is None
+
+
+def test_removed_history_is_not_replayed():
+    cache = AnswerCache(HistoryManager())
+    cache.manager.add(cache, "how to clip raster", 1)
+    del cache.manager.histories[1]
+    assert lookup(cache, "how to clip raster") is None
+    assert cache.manager.connection.execute("SELECT count(*) FROM answer_cache").fetchone()[0] == 0
+
+
+def test_expired_and_evicted_entries():
+    cache = AnswerCache(HistoryManager(), max_size=2)
+    for timestamp in range(1, 4):
+        cache.manager.add(cache, f"question {timestamp}", timestamp)
+    assert lookup(cache, "question 1") is None
+    assert lookup(cache, "question 3") == 3
+
+    cache.ttl = -1
+    assert lookup(cache, "question 3") is None
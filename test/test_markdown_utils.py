@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of HtmlTagStripper and ImageUrlScanner, markdown_utils does not depend on QGIS:
+
+    python -m pytest test
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from markdown_utils import HtmlTagStripper, ImageUrlScanner  # noqa: E402
+
+TEXT = ("<div class=\"note\">第1段 <b>重点</b><br/>内容</div>\n"
+        "Use `<b>` for bold, ``a ` <i> `` stays, <i>this</i> does not.\n"
+        "a < b and c <d, 1 <2> 3\n"
+        "\n"
+        "```html\n"
+        "<div>kept in fence</div>\n"
+        "``` not a closing fence <b>\n"
+        "```\n"
+        "<p>stripped</p>\n"
+        "~~~\n"
+        "<a href=\"x\">kept</a>\n"
+        "~~~\n"
+        "unclosed `code <b>\n"
+        "\n"
+        "<b>after blank line</b>\n")
+
+EXPECTED = ("第1段 重点内容\n"
+            "Use `<b>` for bold, ``a ` <i> `` stays, this does not.\n"
+            "a < b and c <d, 1 <2> 3\n"
+            "\n"
+            "```html\n"
+            "<div>kept in fence</div>\n"
+            "``` not a closing fence <b>\n"
+            "```\n"
+            "stripped\n"
+            "~~~\n"
+            "<a href=\"x\">kept</a>\n"
+            "~~~\n"
+            "unclosed `code <b>\n"
+            "\n"
+            "after blank line\n")
+
+
+def strip(*chunks):
+    stripper = HtmlTagStripper()
+    return "".join(stripper.feed(chunk) for chunk in chunks) + stripper.flush()
+
+
+def test_strip():
+    assert strip(TEXT) == EXPECTED
+
+
+def test_tag_split_at_chunk_boundary():
+    text = "a <span class=\"x\">b</span> c"
+    for split in range(len(text) + 1):
+        assert strip(text[:split], text[split:]) == "a b c"
+
+
+def test_unfinished_tag_is_held_back_until_complete():
+    stripper = HtmlTagStripper()
+    assert stripper.feed("text <b") == "text "
+    assert stripper.feed("r/>more") == "more"
+
+
+def test_unclosed_tag_is_kept_at_the_end():
+    assert strip("x <b", "r") == "x <br"
+
+
+def test_long_unclosed_tag_is_released_as_text():
+    stripper = HtmlTagStripper()
+    text = "x <a" + "b" * HtmlTagStripper.MAX_TAG_LENGTH
+    assert stripper.feed(text) == text
+
+
+def test_fence_split_at_chunk_boundary():
+    assert strip("`", "`", "`\n<b>x</b>\n`", "``\n<b>y</b>\n") == "```\n<b>x</b>\n```\ny\n"
+
+
+def test_backtick_run_split_at_chunk_boundary():
+    # the run of 2 backticks opens the code span, a single one does not close it.
+    assert strip("a `", "`<b>`", " c`", "` <i>d</i>\n") == "a ``<b>` c`` d\n"
+
+
+def test_blank_line_ends_unclosed_code_span():
+    assert strip("`<b>\n", "\n<b>x</b>\n") == "`<b>\n\nx\n"
+
+
+def test_reset_after_flush():
+    stripper = HtmlTagStripper()
+    stripper.feed("```\n<b>")
+    stripper.flush()
+    assert stripper.feed("<b>x</b>\n") == "x\n"
+
+
+def test_output_is_independent_of_splits():
+    for split in range(len(TEXT) + 1):
+        assert strip(TEXT[:split], TEXT[split:]) == EXPECTED
+
+    generator = random.Random(0)
+    for _ in range(200):
+        splits = sorted(generator.sample(range(1, len(TEXT)), generator.randint(1, 40)))
+        chunks = [TEXT[start:end] for start, end in zip([0] + splits, splits + [len(TEXT)])]
+        assert strip(*chunks) == EXPECTED
+
+    assert strip(*TEXT) == EXPECTED
+
+
+IMAGES = ("a ![x](https://a/1.png) [1] [upl-image-preview size=1 url=https://a/2.png] ![y](https://a/3.png)\n"
+          "[UPL-IMAGE-PREVIEW url=https://a/4.png] ![z](https://a/1.png) [x, y]")
+
+
+def scan(*chunks):
+    scanner = ImageUrlScanner()
+    return [url for chunk in chunks for url in scanner.feed(chunk)]
+
+
+def test_image_urls_are_independent_of_splits():
+    expected = ["https://a/1.png", "https://a/2.png", "https://a/3.png", "https://a/4.png"]
+    assert scan(IMAGES) == expected
+    for split in range(len(IMAGES) + 1):
+        assert scan(IMAGES[:split], IMAGES[split:]) == expected
+    assert scan(*IMAGES) == expected
+
+
+def test_brackets_which_never_become_images_are_not_carried():
+    scanner = ImageUrlScanner()
+    scanner.feed("see [1] and [x, y")
+    assert scanner.carry == ""
+    scanner.feed(" and ![alt](https://a/")
+    assert scanner.carry == "![alt](https://a/"
+    scanner.feed("1.png) [upl-ima")
+    assert scanner.carry == "[upl-ima"
+
+
+def test_carry_is_bounded():
+    scanner = ImageUrlScanner()
+    for _ in range(1000):
+        scanner.feed("![" + "a" * 14)
+    assert len(scanner.carry) <= ImageUrlScanner.MAX_CARRY_LENGTH
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of SseParser, the parser does not depend on QGIS:
+
+    python -m pytest test
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_parser import SseParser  # noqa: E402
+
+STREAM = ("\ufeff: keep alive\r\n"
+          "retry: 3000\r\n"
+          "id: 1\r\n"
+          "data: 地理信息\r\n"
+          "data: second line\r\n"
+          "\r\n"
+          "event: chunk\r"
+          "id: 2\r"
+          "data: {\"content\": \"缓冲区\"}\r"
+          "\r"
+          "data:no space\n"
+          "\n").encode('utf-8')
+
+
+def parse(*packets):
+    parser = SseParser()
+    events = []
+    for packet in packets:
+        events.extend(parser.feed(packet))
+    return [(event.event, event.data, event.id, event.retry) for event in events]
+
+
+def test_events():
+    assert parse(STREAM) == [
+        ("message", "地理信息\nsecond line", "1", 3000),
+        ("chunk", "{\"content\": \"缓冲区\"}", "2", 3000),
+        ("message", "no space", "2", 3000),
+    ]
+
+
+def test_crlf_split_across_packets():
+    # the CR at the end of first packet must not dispatch an empty line before the LF.
+    assert parse(b"data: a\r", b"\ndata: b\r", b"\n\r", b"\n") == [("message", "a\nb", "", None)]
+
+
+def test_cr_at_end_of_stream_waits_for_next_packet():
+    parser = SseParser()
+    assert parser.feed(b"data: a\r\r") == []
+    assert [event.data for event in parser.feed(b"data: b\n\n")] == ["a", "b"]
+
+
+def test_bom_split_across_packets():
+    assert parse(b"\xef\xbb", b"\xbfdata: x\n\n") == [("message", "x", "", None)]
+
+
+def test_bom_only_stripped_from_first_line():
+    assert parse("data: x\n\ufeffdata: y\n\n".encode('utf-8')) == [("message", "x", "", None)]
+
+
+def test_multi_byte_character_split_across_packets():
+    data = "data: 缓冲区\n\n".encode('utf-8')
+    assert parse(data[:7], data[7:]) == [("message", "缓冲区", "", None)]
+
+
+def test_id_and_retry_are_kept_between_events():
+    parser = SseParser()
+    parser.feed(b"id: 7\nretry: 1500\ndata: a\n\nretry: x\nid: 8\0\ndata: b\n\n")
+    assert parser.last_event_id == "7"
+    assert parser.retry == 1500
+
+
+def test_buffered_size_is_the_incomplete_line():
+    parser = SseParser()
+    parser.feed(b"data: a\n\ndata: bc")
+    assert parser.buffered_size == len(b"data: bc")
+
+
+def test_output_is_independent_of_splits():
+    expected = parse(STREAM)
+    for split in range(len(STREAM) + 1):
+        assert parse(STREAM[:split], STREAM[split:]) == expected
+
+    generator = random.Random(0)
+    for _ in range(200):
+        splits = sorted(generator.sample(range(1, len(STREAM)), generator.randint(1, 20)))
+        packets = [STREAM[start:end] for start, end in zip([0] + splits, splits + [len(STREAM)])]
+        assert parse(*packets) == expected
+
+    assert parse(*[STREAM[index:index + 1] for index in range(len(STREAM))]) == expected
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+                               Workspace Context
+  A cache of QGIS workspace information which is sent along with questions.
+                              -------------------
+        begin                : 2026-10-18
+        copyright            : (C) 2026 by phoenix-gis
+        email                : phoenixgis@sina.com
+        website              : phoenix-gis.cn
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+from collections import Counter
+from functools import partial
+
+from qgis.PyQt.QtCore import QObject
+from qgis.core import (Qgis, QgsApplication, QgsProject, QgsMapLayer, QgsCoordinateTransform,
+                       QgsCsException)
+
+from .raster_stats import RasterStatsCache, RasterStatsTask
+
+
+class WorkspaceContext(QObject):
+    """
+    Build the workspace information once and keep it up to date with the signals
+    of project, layers and map canvas, so that a snapshot is ready at any time.
+    """
+
+    def __init__(self, iface, parent=None):
+        super().__init__(parent)
+        self.iface = iface
+        self.project = QgsProject.instance()
+
+        self.project_crs_authid = ""
+        self.canvas_extent = []
+        self.canvas_rectangle = None
+
+        # layer id -> layer information, without the visibility.
+        self.layer_infos = {}
+        # layer id -> size of the serialized layer information.
+        self.layer_sizes = {}
+        # layer id -> extent and CRS of layer.
+        self.layer_extents = {}
+        # layer id -> connected signals and slots.
+        self.layer_connections = {}
+
+        # raster band statistics are computed in background tasks.
+        self.stats_cache = RasterStatsCache()
+        # layer id -> running statistics task.
+        self.stats_tasks = {}
+
+        self.project.layersAdded.connect(self.on_layers_added)
+        self.project.layersRemoved.connect(self.on_layers_removed)
+        self.project.crsChanged.connect(self.on_project_crs_changed)
+        self.project.cleared.connect(self.rebuild)
+        self.iface.mapCanvas().extentsChanged.connect(self.on_canvas_extent_changed)
+
+        self.rebuild()
+
+    def unload(self):
+        """disconnect all signals."""
+        self.project.layersAdded.disconnect(self.on_layers_added)
+        self.project.layersRemoved.disconnect(self.on_layers_removed)
+        self.project.crsChanged.disconnect(self.on_project_crs_changed)
+        self.project.cleared.disconnect(self.rebuild)
+        self.iface.mapCanvas().extentsChanged.disconnect(self.on_canvas_extent_changed)
+
+        for layer_id in list(self.layer_connections.keys()):
+            self._disconnect_layer(layer_id)
+
+        for task in self.stats_tasks.values():
+            task.cancel()
+        self.stats_tasks.clear()
+
+    def snapshot(self):
+        """return the current workspace information."""
+        workspace_info = {}
+
+        # qgis version
+        workspace_info["version"] = Qgis.version()
+
+        # CRS part
+        workspace_info["CRSAuthId"] = self.project_crs_authid
+
+        # map canvas parameters.
+        workspace_info["MapCanvasExtent"] = list(self.canvas_extent)
+
+        # the visibility is cheap to read, so it is not cached.
+        layers_info = []
+        layer_tree_root = self.project.layerTreeRoot()
+        for layer_id, cached_info in self.layer_infos.items():
+            node = layer_tree_root.findLayer(layer_id)
+            visible = node.isVisible() if node else False
+
+            layer_info = {
+                "name": cached_info["name"],
+                "type": cached_info["type"],
+                "visible": visible
+            }
+            layer_info.update(cached_info)
+            layers_info.append(layer_info)
+        workspace_info["Layers"] = layers_info
+
+        return workspace_info
+
+    def build_payload(self, prompt: str, budget: int):
+        """
+        Build the workspace information within budget bytes of JSON.
+
+        Layers are ranked by relevance to the prompt, the layers out of budget are
+        sent in a compact form or only counted. Return the information and its size.
+        """
+        workspace_info = self.snapshot()
+        layers_info = workspace_info.pop("Layers")
+        payload_size = len(json.dumps(workspace_info)) + len(', "Layers": []')
+
+        layer_ids = list(self.layer_infos.keys())
+        scores = self._rank_layers(prompt, layer_ids, layers_info)
+        ranked_indexes = sorted(range(len(layer_ids)), key=lambda index: -scores[index])
+
+        included_layers = []
+        omitted_layers = []
+        for index in ranked_indexes:
+            layer_info = layers_info[index]
+
+            # the cached size does not contain the visibility.
+            layer_size = self.layer_sizes.get(layer_ids[index], 0) + len(', "visible": false, ')
+            if payload_size + layer_size > budget:
+                layer_info = self._compact_layer_info(layer_info)
+                layer_size = len(json.dumps(layer_info)) + 2
+                if payload_size + layer_size > budget:
+                    omitted_layers.append(layers_info[index])
+                    continue
+
+            included_layers.append(layer_info)
+            payload_size += layer_size
+
+        workspace_info["Layers"] = included_layers
+
+        # summarize the layers out of budget.
+        if omitted_layers:
+            workspace_info["OmittedLayers"] = {
+                "count": len(omitted_layers),
+                "by_type": dict(Counter(layer_info["type"] for layer_info in omitted_layers)),
+                "by_crs": dict(Counter(layer_info["CRSAuthId"] for layer_info in omitted_layers))
+            }
+
+        return workspace_info, len(json.dumps(workspace_info))
+
+    def rebuild(self):
+        """build all the information from scratch."""
+        for layer_id in list(self.layer_connections.keys()):
+            self._disconnect_layer(layer_id)
+        self.layer_infos.clear()
+        self.layer_sizes.clear()
+        self.layer_extents.clear()
+
+        for task in self.stats_tasks.values():
+            task.cancel()
+        self.stats_tasks.clear()
+
+        self.on_project_crs_changed()
+        self.on_canvas_extent_changed()
+        self.on_layers_added(self.project.mapLayers().values())
+
+    def on_layers_added(self, layers):
+        for layer in layers:
+            layer_id = layer.id()
+            self.update_layer(layer_id)
+
+            # rebuild the layer information when it is changed.
+            slot = partial(self.update_layer, layer_id)
+            signals = [layer.nameChanged, layer.crsChanged, layer.dataSourceChanged]
+            if layer.type() == QgsMapLayer.VectorLayer:
+                signals.append(layer.updatedFields)
+            for signal in signals:
+                signal.connect(slot)
+            self.layer_connections[layer_id] = [(signal, slot) for signal in signals]
+
+    def on_layers_removed(self, layer_ids):
+        for layer_id in layer_ids:
+            self.layer_infos.pop(layer_id, None)
+            self.layer_sizes.pop(layer_id, None)
+            self.layer_extents.pop(layer_id, None)
+            self.layer_connections.pop(layer_id, None)
+
+            task = self.stats_tasks.pop(layer_id, None)
+            if task:
+                task.cancel()
+
+    def on_project_crs_changed(self):
+        self.project_crs_authid = self.project.crs().authid()
+
+    def on_canvas_extent_changed(self):
+        canvas_extent = self.iface.mapCanvas().extent()
+        self.canvas_rectangle = canvas_extent
+        self.canvas_extent = [
+            f"{canvas_extent.xMinimum():.6f}",
+            f"{canvas_extent.yMinimum():.6f}",
+            f"{canvas_extent.xMaximum():.6f}",
+            f"{canvas_extent.yMaximum():.6f}"]
+
+    def update_layer(self, layer_id):
+        layer = self.project.mapLayer(layer_id)
+        if layer is None:
+            return
+
+        layer_info = self._build_layer_info(layer)
+        self.layer_infos[layer_id] = layer_info
+        self.layer_sizes[layer_id] = len(json.dumps(layer_info))
+        self.layer_extents[layer_id] = (layer.extent(), layer.crs())
+
+    def on_stats_task_completed(self, task):
+        if self.stats_tasks.get(task.layer_id) is not task:
+            return
+
+        del self.stats_tasks[task.layer_id]
+        self.stats_cache.put(task.cache_key, task.bands_stats)
+        self.update_layer(task.layer_id)
+
+    def on_stats_task_terminated(self, task):
+        if self.stats_tasks.get(task.layer_id) is task:
+            del self.stats_tasks[task.layer_id]
+
+    def _request_raster_stats(self, layer, cache_key):
+        """compute the band statistics of layer in background."""
+        running_task = self.stats_tasks.get(layer.id())
+        if running_task:
+            if running_task.cache_key == cache_key:
+                return
+            running_task.cancel()
+
+        task = RasterStatsTask(layer, cache_key)
+        task.taskCompleted.connect(partial(self.on_stats_task_completed, task))
+        task.taskTerminated.connect(partial(self.on_stats_task_terminated, task))
+        self.stats_tasks[layer.id()] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _rank_layers(self, prompt, layer_ids, layers_info):
+        """score layers by mentioned in prompt, selected in layer tree, in map canvas and visible."""
+        prompt = prompt.lower()
+        selected_layer_ids = {layer.id() for layer in self.iface.layerTreeView().selectedLayers()}
+        canvas_crs = self.iface.mapCanvas().mapSettings().destinationCrs()
+
+        scores = []
+        for layer_id, layer_info in zip(layer_ids, layers_info):
+            score = 0
+            if layer_info["name"] and layer_info["name"].lower() in prompt:
+                score += 8
+            if layer_id in selected_layer_ids:
+                score += 4
+            if self._is_layer_in_canvas(layer_id, canvas_crs):
+                score += 2
+            if layer_info["visible"]:
+                score += 1
+            scores.append(score)
+        return scores
+
+    def _is_layer_in_canvas(self, layer_id, canvas_crs):
+        if self.canvas_rectangle is None or layer_id not in self.layer_extents:
+            return False
+
+        extent, crs = self.layer_extents[layer_id]
+        try:
+            if crs != canvas_crs:
+                transform = QgsCoordinateTransform(crs, canvas_crs, self.project)
+                extent = transform.transformBoundingBox(extent)
+        except QgsCsException:
+            return False
+        return extent.intersects(self.canvas_rectangle)
+
+    def _compact_layer_info(self, layer_info):
+        """keep the basic information and counts of fields and bands only."""
+        compact_info = {
+            "name": layer_info["name"],
+            "type": layer_info["type"],
+            "visible": layer_info["visible"],
+            "CRSAuthId": layer_info["CRSAuthId"]
+        }
+        if "fields" in layer_info:
+            compact_info["field_count"] = len(layer_info["fields"])
+        if "bands" in layer_info:
+            compact_info["band_count"] = len(layer_info["bands"])
+        return compact_info
+
+    def _disconnect_layer(self, layer_id):
+        for signal, slot in self.layer_connections.pop(layer_id, []):
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                # the layer has been deleted.
+                pass
+
+    def _build_layer_info(self, layer):
+        layer_info = {}
+        layer_info["name"] = f"{layer.name()}"
+        layer_info["type"] = f"{layer.type().name}"
+
+        crs = layer.crs()
+        layer_info["CRSAuthId"] = f"{crs.authid()}"
+
+        # get fields data in vector data.
+        if layer.type() == QgsMapLayer.VectorLayer:
+            fields_info = []
+            fields = layer.fields()
+            for field in fields:
+                field_info = {
+                    "name": field.name(),
+                    "type": field.typeName(),
+                    "length": field.length(),
+                    "precision": field.precision()
+                }
+                fields_info.append(field_info)
+            layer_info["fields"] = fields_info
+
+        # get bands data in raster data.
+        elif layer.type() == QgsMapLayer.RasterLayer:
+            bands_info = []
+            provider = layer.dataProvider()
+            if provider:
+                # basic raster variables.
+                layer_info["raster_width"] = provider.xSize()
+                layer_info["raster_height"] = provider.ySize()
+
+                # extent of data.
+                extent = provider.extent()
+                layer_info["raster_extent"] = [
+                    f"{extent.xMinimum():.6f}",
+                    f"{extent.yMinimum():.6f}",
+                    f"{extent.xMaximum():.6f}",
+                    f"{extent.yMaximum():.6f}"
+                ]
+
+                if provider.xSize() > 0 and provider.ySize() > 0:
+                    pixel_size_x = (extent.xMaximum() - extent.xMinimum()) / provider.xSize()
+                    pixel_size_y = (extent.yMaximum() - extent.yMinimum()) / provider.ySize()
+                    layer_info["pixel_size"] = [
+                        f"{pixel_size_x:.6f}",
+                        f"{pixel_size_y:.6f}"
+                    ]
+
+                layer_info["origin"] = [
+                    f"{extent.xMinimum():.6f}",
+                    f"{extent.yMaximum():.6f}"
+                ]
+
+                # statistics are computed in background, mark them pending until ready.
+                cache_key = self.stats_cache.cache_key(layer)
+                bands_stats = self.stats_cache.get(cache_key)
+                if bands_stats is None:
+                    self._request_raster_stats(layer, cache_key)
+
+                band_count = provider.bandCount()
+                for band in range(1, band_count + 1):
+                    band_info = {
+                        "band_number": band,
+                        "band_name": f"Band {band}",
+                        "data_type": provider.dataType(band),
+                        "color_interpretation": provider.colorInterpretation(band).name
+                    }
+
+                    if bands_stats is not None and band <= len(bands_stats):
+                        band_info.update(bands_stats[band - 1])
+                    else:
+                        band_info["statistics"] = "pending"
+                    bands_info.append(band_info)
+            layer_info["bands"] = bands_info
+
+        return layer_info